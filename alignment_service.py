@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import queue
+import shlex
+import subprocess
+import threading
+import uuid
+from concurrent.futures import Future
+from local_socket import serve_json, request_json
+
+# Long-running alignment worker: one Singularity session is started once and
+# fed RunAlignment.sh jobs from a local queue, instead of paying container
+# startup for every song. Jobs arrive over a Unix socket or as a batch.
+ALIGNER_IMAGE = "kaldi.simg"
+ALIGNER_SCRIPT = "./RunAlignment.sh"
+
+
+class SingularityAligner:
+    def __init__(self, aligner_dir, image=ALIGNER_IMAGE, script=ALIGNER_SCRIPT):
+        self.aligner_dir = aligner_dir
+        self.image = image
+        self.script = script
+        self.process = None
+
+    def start(self):
+        # A shell inside the container stays up and runs one alignment per command
+        self.process = subprocess.Popen(
+            ["singularity", "exec", self.image, "bash"],
+            cwd=self.aligner_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+
+    def align(self, input_audio, input_lyrics, output_file):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        marker = uuid.uuid4().hex
+        args = " ".join(shlex.quote(os.path.abspath(path)) for path in (input_audio, input_lyrics, output_file))
+        # The script's own output goes to stderr so stdout only carries completion
+        # markers, and it reads nothing from the session's stdin, which holds later jobs
+        try:
+            self.process.stdin.write(f"{self.script} {args} 1>&2 < /dev/null; echo {marker} $?\n")
+            self.process.stdin.flush()
+            for line in self.process.stdout:
+                if line.startswith(marker):
+                    status = int(line.split()[1])
+                    if status != 0:
+                        raise RuntimeError(f"RunAlignment.sh exited with code {status}")
+                    return output_file
+        except BrokenPipeError:
+            pass
+        # The session died with this job, the next one starts a fresh session
+        self.restart()
+        raise RuntimeError("Alignment session ended unexpectedly")
+
+    def restart(self):
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+        self.start()
+
+    def close(self):
+        if self.process:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+
+class StubAligner:
+    """Offline stand-in that spreads the lyric words evenly over the audio."""
+
+    def __init__(self, duration=None):
+        self.duration = duration
+
+    def start(self):
+        pass
+
+    def align(self, input_audio, input_lyrics, output_file):
+        with open(input_lyrics, 'r', encoding='utf-8') as f:
+            words = f.read().replace('-', ' ').split()
+        duration = self.duration if self.duration is not None else audio_duration(input_audio)
+        step = duration / max(len(words), 1)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for i, word in enumerate(words):
+                f.write(f"{i * step:.2f} {(i + 1) * step:.2f} {word.upper()}\n")
+        return output_file
+
+    def close(self):
+        pass
+
+
+def audio_duration(path):
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path]
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
+    return float(result.stdout.strip())
+
+
+class AlignmentService:
+    def __init__(self, aligner):
+        self.aligner = aligner
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        self.aligner.start()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.jobs.put(None)
+        self.thread.join()
+        self.aligner.close()
+
+    def _worker(self):
+        # A single session handles jobs one at a time, in arrival order
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            future, paths = job
+            try:
+                future.set_result(self.aligner.align(*paths))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, input_audio, input_lyrics, output_file):
+        future = Future()
+        self.jobs.put((future, (input_audio, input_lyrics, output_file)))
+        return future
+
+    def align_batch(self, pairs):
+        futures = [self.submit(pair["audio"], pair["lyrics"], pair["output"]) for pair in pairs]
+        results = []
+        for pair, future in zip(pairs, futures):
+            try:
+                results.append({"output": future.result(), "ok": True})
+            except Exception as e:
+                results.append({"output": pair["output"], "ok": False, "error": str(e)})
+        return results
+
+    def handle(self, request):
+        command = request.get("command")
+        if command == "align":
+            output_file = self.submit(request["audio"], request["lyrics"], request["output"]).result()
+            return {"ok": True, "output": output_file}
+        if command == "align_batch":
+            return {"ok": True, "results": self.align_batch(request["pairs"])}
+        if command == "ping":
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown command: {command}"}
+
+    def serve(self, socket_path):
+        server = serve_json(socket_path, self.handle)
+        print(f"Alignment service listening on {socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(socket_path)
+
+
+def align_via_service(socket_path, input_audio, input_lyrics, output_file):
+    request = {"command": "align", "audio": os.path.abspath(input_audio),
+               "lyrics": os.path.abspath(input_lyrics), "output": os.path.abspath(output_file)}
+    response = request_json(socket_path, request)
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error"))
+    return output_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent lyrics alignment worker")
+    parser.add_argument('--socket', help='Serve alignment jobs on this Unix socket')
+    parser.add_argument('--batch', metavar='PAIRS', help='Align a JSON list of {"audio", "lyrics", "output"} in one session')
+    parser.add_argument('--aligner_dir', default=os.path.abspath("NUSAutoLyrixAlign"), help='Directory holding kaldi.simg and RunAlignment.sh')
+    parser.add_argument('--stub', action='store_true', help='Use the offline stub aligner')
+    args = parser.parse_args()
+
+    aligner = StubAligner() if args.stub else SingularityAligner(args.aligner_dir)
+    service = AlignmentService(aligner)
+    service.start()
+    try:
+        if args.batch:
+            with open(args.batch, 'r', encoding='utf-8') as f:
+                pairs = json.load(f)
+            for result in service.align_batch(pairs):
+                print(f"{result['output']}: {'ok' if result['ok'] else result['error']}")
+        elif args.socket:
+            service.serve(args.socket)
+        else:
+            parser.error("one of --socket or --batch is required")
+    finally:
+        service.stop()
+
+if __name__ == "__main__":
+    main()
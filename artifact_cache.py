@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+# Content-addressed store for stage outputs. An entry is keyed by the stage
+# name, the track ID and the stage's inputs/parameters, and holds a few files
+# plus a small JSON metadata dict. Least recently used entries are evicted once
+# the store grows past its size budget.
+DEFAULT_CACHE_DIR = os.environ.get("SPEEDUP_CACHE_DIR") or os.path.expanduser("~/.cache/speedupmaker")
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+MANIFEST_FILE = "manifest.json"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_key(stage, track_id, params):
+    payload = json.dumps({"stage": stage, "track": track_id, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ArtifactStore:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, stage, track_id, params):
+        """Return the manifest of a stored entry (with absolute file paths), or None."""
+        entry_dir = self._entry_dir(artifact_key(stage, track_id, params))
+        manifest_path = os.path.join(entry_dir, MANIFEST_FILE)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            os.utime(manifest_path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        manifest["files"] = {name: os.path.join(entry_dir, name) for name in manifest["files"]}
+        return manifest
+
+    def fetch(self, stage, track_id, params, dest_dir="."):
+        """Copy a stored entry's files into `dest_dir` and return its metadata, or None on a miss."""
+        manifest = self.get(stage, track_id, params)
+        if manifest is None:
+            return None
+        try:
+            for name, path in manifest["files"].items():
+                target = os.path.join(dest_dir, name)
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                shutil.copyfile(path, target)
+        except OSError:
+            return None  # evicted while copying
+        return manifest["meta"]
+
+    def put(self, stage, track_id, params, files, meta=None):
+        """Store `files` ({name: path}) and `meta` under the stage key."""
+        key = artifact_key(stage, track_id, params)
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_dir)
+        try:
+            for name, path in files.items():
+                target = os.path.join(tmp_dir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(path, target)
+            manifest = {"stage": stage, "track": track_id, "params": params, "files": sorted(files), "meta": meta or {}}
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=4)
+            # Renaming the finished directory keeps concurrent jobs from seeing partial entries
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                raise
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for bucket in os.listdir(self.root):
+            bucket_dir = os.path.join(self.root, bucket)
+            if not os.path.isdir(bucket_dir):
+                continue
+            for key in os.listdir(bucket_dir):
+                entry_dir = os.path.join(bucket_dir, key)
+                manifest_path = os.path.join(entry_dir, MANIFEST_FILE)
+                if key.endswith(".tmp") or not os.path.exists(manifest_path):
+                    continue
+                size = 0
+                for dirpath, _, filenames in os.walk(entry_dir):
+                    size += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+                entries.append((os.path.getmtime(manifest_path), size, entry_dir))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the store fits in max_bytes."""
+        try:
+            entries = sorted(self._entries())
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
@@ -0,0 +1,132 @@
+import random
+import textwrap
+from PIL import ImageColor
+from lyric_index import SentenceIndex
+from text_sprites import get_font
+
+# Karaoke subtitle backend: the lyric timeline becomes an Advanced
+# SubStation Alpha script that libass rasterizes while ffmpeg encodes, so no
+# overlay is ever drawn in Python. Layout mirrors the PIL renderer: wrapped
+# sentences centered on a 1080x1920 frame, a 2px outline in the sprites'
+# opaque black shadow color standing in for draw_text_with_shadow and the
+# WORD_COLORS/LINE_COLORS palette.
+PLAY_RES = (1080, 1920)
+WRAP_WIDTH = 15
+OUTLINE = 2
+OUTLINE_COLOR = "black"
+
+
+def ass_color(color, alpha=255):
+    """'#RRGGBB' (or a name PIL knows) to ASS &HAABBGGRR, where ASS alpha 0 is opaque."""
+    red, green, blue = ImageColor.getrgb(color)[:3]
+    return f"&H{255 - alpha:02X}{blue:02X}{green:02X}{red:02X}"
+
+
+def override_color(color):
+    # Inline \1c/\2c overrides carry no alpha byte
+    return f"&H{ass_color(color)[4:]}&"
+
+
+def ass_time(ms):
+    centiseconds = max(0, int(round(ms / 10)))
+    hours, rest = divmod(centiseconds, 360000)
+    minutes, rest = divmod(rest, 6000)
+    seconds, centiseconds = divmod(rest, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+
+def ass_font_size(font_path, font_size):
+    # libass sizes a font by its ascent + descent, PIL by its em square
+    ascent, descent = get_font(font_path, font_size).getmetrics()
+    return ascent + descent
+
+
+def escape_text(text):
+    return text.replace("\\", "").replace("{", "(").replace("}", ")")
+
+
+def karaoke_text(index, start_ms, end_ms):
+    """Wrapped lines with a \\k tag per display word, timed from the word's start to the next one."""
+    segments = []
+    for line_number, slots in enumerate(index.line_slots):
+        for slot_number, (word, indices) in enumerate(slots):
+            text = escape_text(word)
+            if slot_number < len(slots) - 1:
+                text += " "
+            elif line_number < len(index.line_slots) - 1:
+                text += "\\N"
+            start = int(index.starts[min(indices)]) if indices else None
+            segments.append((text, start))
+
+    parts = []
+    cursor = start_ms
+    timed = [start for _, start in segments if start is not None]
+    if timed and timed[0] > cursor:
+        # Nothing is highlighted until the first word is sung
+        parts.append(f"{{\\k{round((timed[0] - cursor) / 10)}}}")
+        cursor = timed[0]
+    next_timed = 0
+    for text, start in segments:
+        if start is None:
+            parts.append(f"{{\\k0}}{text}")
+            continue
+        next_timed += 1
+        until = timed[next_timed] if next_timed < len(timed) else end_ms
+        until = max(until, cursor)
+        # Rounded on absolute times so durations do not drift over the sentence
+        parts.append(f"{{\\k{round(until / 10) - round(cursor / 10)}}}{text}")
+        cursor = until
+    return "".join(parts)
+
+
+def build_ass_script(timeline, font_path, word_colors, line_colors, color_index=0, layout_seed=None):
+    font = get_font(font_path, 80)
+    family, style = font.getname()
+    bold = -1 if "Bold" in style else 0
+    width, height = PLAY_RES
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+        "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: Lyrics,{family},{ass_font_size(font_path, 80)},{ass_color(word_colors[0])},{ass_color(line_colors[0])},"
+        f"{ass_color(OUTLINE_COLOR)},&H00000000,{bold},0,0,0,100,100,0,0,1,{OUTLINE},0,5,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+
+    line_color_index = 0
+    rng = random.Random(layout_seed)
+    for sentence in timeline.sentences:
+        # Same skip rule, size range and color order as build_lyric_events
+        if not sentence.text.strip() or not sentence.count:
+            continue
+
+        font_size = rng.randint(65, 95)
+        index = SentenceIndex.from_columns(textwrap.wrap(sentence.text, width=WRAP_WIDTH), *timeline.columns(sentence))
+        start_ms, end_ms = int(index.starts.min()), int(index.ends[-1])
+        overrides = (
+            f"{{\\fs{ass_font_size(font_path, font_size)}"
+            f"\\1c{override_color(word_colors[color_index % len(word_colors)])}"
+            f"\\2c{override_color(line_colors[line_color_index % len(line_colors)])}}}"
+        )
+        lines.append(
+            f"Dialogue: 0,{ass_time(start_ms)},{ass_time(end_ms)},Lyrics,,0,0,0,,"
+            f"{overrides}{karaoke_text(index, start_ms, end_ms)}"
+        )
+        color_index += 1
+        line_color_index += 1
+    return "\n".join(lines) + "\n"
+
+
+def write_ass_file(timeline, output_file, font_path, word_colors, line_colors, color_index=0, layout_seed=None):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(build_ass_script(timeline, font_path, word_colors, line_colors, color_index, layout_seed))
+    return output_file
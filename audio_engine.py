@@ -0,0 +1,136 @@
+import subprocess
+import wave
+import numpy as np
+
+# Windowed time-stretch engine: decode only the source window a clip needs,
+# stretch it and write the result. Backends: a vectorized NumPy WSOLA, or
+# ffmpeg's atempo / rubberband filters.
+SAMPLE_RATE = 44100
+CHANNELS = 2
+BACKENDS = ("numpy", "atempo", "rubberband")
+# "tempo" keeps the pitch, "nightcore" plays faster and higher like a sped-up record
+MODES = ("tempo", "nightcore")
+
+
+def decode_window(filename, start_ms, duration_ms, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    command = [
+        "ffmpeg", "-v", "error", "-ss", f"{start_ms / 1000:.3f}", "-t", f"{duration_ms / 1000:.3f}",
+        "-i", filename, "-f", "f32le", "-ac", str(channels), "-ar", str(sample_rate), "pipe:",
+    ]
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE)
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def write_wav(path, samples, sample_rate=SAMPLE_RATE):
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def resample(samples, factor):
+    """Play `samples` `factor` times faster by linear interpolation (pitch shifts too)."""
+    n_out = int(len(samples) / factor)
+    positions = np.arange(n_out) * factor
+    left = positions.astype(np.int64)
+    right = np.minimum(left + 1, len(samples) - 1)
+    frac = (positions - left)[:, None].astype(np.float32)
+    return samples[left] * (1 - frac) + samples[right] * frac
+
+
+def _best_offset(region, template, tolerance):
+    # Cross-correlation through the FFT, only the 2 * tolerance + 1 valid lags are kept
+    n = len(region) + len(template)
+    spectrum = np.fft.rfft(region, n) * np.conj(np.fft.rfft(template, n))
+    correlation = np.fft.irfft(spectrum, n)[:2 * tolerance + 1]
+    return int(np.argmax(correlation)) - tolerance
+
+
+def wsola(samples, factor, frame_size=2048, tolerance=512):
+    """Pitch-preserving time stretch (waveform similarity overlap-add)."""
+    hop = frame_size // 2
+    analysis_hop = hop * factor
+    window = np.hanning(frame_size + 1)[:-1].astype(np.float32)[:, None]
+
+    n_out = int(len(samples) / factor)
+    n_frames = max(1, -(-max(n_out - frame_size, 0) // hop) + 1)
+    pad_end = int(n_frames * analysis_hop) + frame_size + 2 * tolerance + hop - len(samples)
+    padded = np.pad(samples, ((tolerance, max(pad_end, 0) + tolerance), (0, 0)))
+    mono = padded.mean(axis=1)
+
+    out = np.zeros(((n_frames - 1) * hop + frame_size, samples.shape[1]), dtype=np.float32)
+    previous = None
+    for k in range(n_frames):
+        # Positions are in padded coordinates, `nominal` sits tolerance samples into the search region
+        nominal = int(round(k * analysis_hop)) + tolerance
+        position = nominal
+        if previous is not None:
+            template = mono[previous + hop:previous + hop + frame_size]
+            region = mono[nominal - tolerance:nominal + tolerance + frame_size]
+            position = nominal + _best_offset(region, template, tolerance)
+        out[k * hop:k * hop + frame_size] += padded[position:position + frame_size] * window
+        previous = position
+    return out[:n_out]
+
+
+def _ffmpeg_tempo_filters(speed_factor, backend, mode):
+    if mode == "nightcore":
+        return [f"asetrate={SAMPLE_RATE}*{speed_factor}", f"aresample={SAMPLE_RATE}"]
+    if backend == "rubberband":
+        return [f"rubberband=tempo={speed_factor}"]
+    # atempo only takes factors in [0.5, 2] on older ffmpeg builds, chain it beyond that
+    filters = []
+    remaining = speed_factor
+    while remaining > 2.0:
+        filters.append("atempo=2.0")
+        remaining /= 2.0
+    while remaining < 0.5:
+        filters.append("atempo=0.5")
+        remaining /= 0.5
+    filters.append(f"atempo={remaining}")
+    return filters
+
+
+def stretch_with_ffmpeg(input_args, output_file, speed_factor, start_ms, duration_ms, backend, mode):
+    # `input_args` ends with the -i option, e.g. ["-i", filename]
+    filters = [f"aresample={SAMPLE_RATE}"] + _ffmpeg_tempo_filters(speed_factor, backend, mode)
+    command = [
+        "ffmpeg", "-v", "error", "-y", "-ss", f"{start_ms / 1000:.3f}", "-t", f"{duration_ms * speed_factor / 1000:.3f}",
+        *input_args, "-af", ",".join(filters), "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE),
+        "-t", f"{duration_ms / 1000:.3f}", output_file,
+    ]
+    subprocess.run(command, check=True)
+
+
+def stretch_samples(samples, speed_factor, mode="tempo"):
+    if mode == "nightcore":
+        return resample(samples, speed_factor)
+    return wsola(samples, speed_factor)
+
+
+def stretch_audio_window(filename, output_file, speed_factor, duration_ms, start_ms=0, backend="numpy", mode="tempo"):
+    """Write `duration_ms` of audio sped up by `speed_factor`, taken from `start_ms` of `filename`.
+
+    `filename` may also be a decoded pcm_buffer.PCMBuffer, which is sliced instead of decoded.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown audio backend: {backend}")
+    if mode not in MODES:
+        raise ValueError(f"Unknown audio mode: {mode}")
+
+    decoded = hasattr(filename, "slice_ms")
+    if backend != "numpy":
+        input_args = filename.ffmpeg_input_args() if decoded else ["-i", filename]
+        stretch_with_ffmpeg(input_args, output_file, speed_factor, start_ms, duration_ms, backend, mode)
+        return output_file
+
+    # Only the source covering the output is decoded, or sliced from the decoded track
+    if decoded:
+        samples = filename.slice_ms(start_ms, duration_ms * speed_factor)
+    else:
+        samples = decode_window(filename, start_ms, duration_ms * speed_factor)
+    stretched = stretch_samples(samples, speed_factor, mode)
+    write_wav(output_file, stretched[:int(duration_ms * SAMPLE_RATE / 1000)])
+    return output_file
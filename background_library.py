@@ -0,0 +1,167 @@
+import json
+import os
+import random
+import subprocess
+import uuid
+import ffmpeg
+from video_renderer import OUTPUT_SIZE, probe_video
+
+# Persistent index of the background video library plus a cache of clips
+# already normalized to the output geometry, so a run only concatenates the
+# few clips it needs with stream copy.
+INDEX_FILE = ".library_index.json"
+NORMALIZED_DIR = ".normalized"
+NORMALIZED_FPS = 30
+FADE_FRAMES = 30
+INDEX_VERSION = 1
+
+
+def probe_keyframes(path):
+    # Packet flags are enough to find keyframes, no decoding needed
+    command = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path,
+    ]
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
+    keyframes = []
+    for line in result.stdout.splitlines():
+        parts = line.split(",")
+        if len(parts) >= 2 and "K" in parts[1] and parts[0] not in ("", "N/A"):
+            keyframes.append(round(float(parts[0]), 3))
+    return keyframes
+
+
+def probe_clip(path):
+    entry = probe_video(path)
+    entry["keyframes"] = probe_keyframes(path)
+    return entry
+
+
+def load_index(path):
+    index_path = os.path.join(path, INDEX_FILE)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return {"version": INDEX_VERSION, "clips": {}}
+
+
+def save_index(path, index):
+    index_path = os.path.join(path, INDEX_FILE)
+    # Concurrent batch jobs may save at the same time, each writes its own temp file
+    tmp_path = f"{index_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def update_index(path):
+    """Bring the library index up to date, probing only new or changed files."""
+    index = load_index(path)
+    clips = {}
+    changed = False
+
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".mp4"):
+            continue
+        stat = os.stat(os.path.join(path, name))
+        entry = index["clips"].get(name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            clips[name] = entry
+            continue
+        try:
+            entry = probe_clip(os.path.join(path, name))
+        except Exception as e:
+            print(f"Skipping background {name}: {e}")
+            continue
+        entry["size"] = stat.st_size
+        entry["mtime"] = stat.st_mtime
+        clips[name] = entry
+        changed = True
+
+    if changed or set(clips) != set(index["clips"]):
+        index["clips"] = clips
+        save_index(path, index)
+    return index
+
+
+def normalized_clip_path(path, name, size=OUTPUT_SIZE):
+    stem = os.path.splitext(name)[0]
+    return os.path.join(path, NORMALIZED_DIR, f"{stem}_{size[0]}x{size[1]}.mp4")
+
+
+def is_fresh(target, source):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def normalize_clip(path, name, size=OUTPUT_SIZE):
+    """Return the cached copy of a clip scaled to the output geometry, creating it if needed."""
+    source = os.path.join(path, name)
+    target = normalized_clip_path(path, name, size)
+    if is_fresh(target, source):
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # A unique temp file per writer, so concurrent jobs never encode into the same file
+    tmp_target = f"{target}.{uuid.uuid4().hex}.tmp.mp4"
+    v = ffmpeg.input(source).video
+    v = v.filter('scale', size[0], size[1])
+    v = v.filter('setsar', '1')
+    v = v.filter('fps', fps=NORMALIZED_FPS)
+    v = v.filter_('fade', type='in', start_frame=0, nb_frames=FADE_FRAMES)
+    # Identical codec settings and a keyframe every second keep the clips
+    # concatenable with stream copy and cuttable on whole seconds.
+    out = ffmpeg.output(v, tmp_target, vcodec='libx264', pix_fmt='yuv420p', g=NORMALIZED_FPS, preset='veryfast', crf=18)
+    try:
+        out.overwrite_output().global_args('-loglevel', 'error').run()
+        os.replace(tmp_target, target)
+    except Exception:
+        # Another job finished the same clip first, its copy is as good as ours
+        if is_fresh(target, source):
+            return target
+        raise
+    finally:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+    return target
+
+
+def select_clips(index, source_duration, rng=random):
+    """Pick shuffled clips until they cover `source_duration` seconds."""
+    names = list(index["clips"])
+    rng.shuffle(names)
+    selected = []
+    covered = 0.0
+    for name in names:
+        if covered >= source_duration:
+            break
+        selected.append(name)
+        covered += index["clips"][name]["duration"]
+    return selected
+
+
+def build_background(path, source_duration, output_file, size=OUTPUT_SIZE, rng=random):
+    index = update_index(path)
+    selected = select_clips(index, source_duration, rng)
+    if not selected:
+        raise RuntimeError(f"No background videos found in {path}")
+
+    list_file = os.path.splitext(output_file)[0] + "_concat.txt"
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for name in selected:
+            clip = os.path.abspath(normalize_clip(path, name, size))
+            f.write("file '{}'\n".format(clip.replace("'", "'\\''")))
+
+    try:
+        out = ffmpeg.input(list_file, format='concat', safe=0).output(output_file, c='copy', t=source_duration)
+        out.overwrite_output().global_args('-loglevel', 'error').run()
+    finally:
+        os.remove(list_file)
+    return output_file
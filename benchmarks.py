@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import numpy as np
+import full_script
+from audio_engine import SAMPLE_RATE, write_wav
+from pcm_buffer import PCMBuffer
+from text_sprites import SpriteCache
+from timeline import Timeline
+
+# Offline benchmarks for every pipeline stage. Fixtures are synthesized
+# locally (sine-tone audio, fake aligner output, sentence JSON, solid-color
+# backgrounds), so no network, Spotify, Genius or Singularity is needed.
+# Results go to a JSON file that --compare can diff against another run.
+VOCABULARY = ["amour", "nuit", "ville", "soleil", "coeur", "route", "reve", "ciel", "temps", "feu",
+              "baby", "yeah", "love", "tonight", "never", "always", "money", "dance", "fly", "home"]
+COLORS = ["red", "blue", "green", "purple", "orange", "teal"]
+# Fixed font-size draw for the rendering benchmarks, so runs compare across commits
+LAYOUT_SEED = 1234
+
+SIZES = {
+    "words": [250, 1000, 4000],
+    "clip_seconds": [10, 26, 60],
+    "render_seconds": [5, 15],
+    "library_clips": [2, 8, 24],
+}
+QUICK_SIZES = {
+    "words": [250],
+    "clip_seconds": [10],
+    "render_seconds": [3],
+    "library_clips": [2],
+}
+
+
+# Fixtures
+def make_lyrics(n_words, rng):
+    lines, remaining = [], n_words
+    while remaining > 0:
+        length = min(remaining, rng.randint(4, 8))
+        lines.append(" ".join(rng.choice(VOCABULARY) for _ in range(length)))
+        remaining -= length
+    return "\n".join(lines)
+
+
+def make_aligned_text(lyrics_text, word_seconds=0.35, breath_every=0):
+    # "start end WORD" lines like the aligner writes, optionally with BREATH* placeholders
+    lines = []
+    for i, word in enumerate(lyrics_text.split()):
+        start = i * word_seconds
+        token = "BREATH*" if breath_every and i % breath_every == breath_every - 1 else word.upper()
+        lines.append(f"{start:.2f} {start + word_seconds * 0.9:.2f} {token}")
+    return "\n".join(lines) + "\n"
+
+
+def make_sentences(lyrics_text, word_seconds=0.35):
+    sentences, t = [], 0
+    for line in lyrics_text.split("\n"):
+        words = []
+        for word in line.split():
+            words.append({"startTimeMs": str(int(t * 1000)), "words": word.upper(),
+                          "endTimeMs": str(int((t + word_seconds * 0.9) * 1000))})
+            t += word_seconds
+        sentences.append({"sentence": line, "words": words})
+    return sentences
+
+
+def make_tone(path, seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = (0.3 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 660 * t)).astype(np.float32)
+    write_wav(path, np.stack([tone, tone], axis=1))
+    return path
+
+
+def make_color_clip(path, color, seconds, size=(1280, 720), fps=30):
+    command = [
+        "ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"color=c={color}:s={size[0]}x{size[1]}:r={fps}:d={seconds}",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "ultrafast", path,
+    ]
+    subprocess.run(command, check=True)
+    return path
+
+
+def make_library(path, n_clips, seconds=5):
+    os.makedirs(path, exist_ok=True)
+    for i in range(n_clips):
+        make_color_clip(os.path.join(path, f"clip_{i:03d}.mp4"), COLORS[i % len(COLORS)], seconds)
+    return path
+
+
+# Harness
+def measure(func, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ok = func()
+        runs.append(time.perf_counter() - start)
+        if ok is False or ok is None:
+            return runs, False
+    return runs, True
+
+
+def bench(results, name, size, func, repeat):
+    runs, ok = measure(func, repeat)
+    result = {"benchmark": name, "size": size, "seconds": round(statistics.median(runs), 5),
+              "runs": [round(run, 5) for run in runs], "ok": ok}
+    results.append(result)
+    print(f"{name:<28} {json.dumps(size):<28} {result['seconds']:>10.4f}s{'' if ok else '  FAILED'}")
+
+
+def skip(results, name, size, reason):
+    # Recorded so a comparison shows the benchmark was not run instead of losing it
+    results.append({"benchmark": name, "size": size, "seconds": None, "skipped": reason})
+    print(f"{name:<28} {json.dumps(size):<28}    skipped: {reason}")
+
+
+def run_benchmarks(workdir, sizes, repeat, only=None):
+    rng = random.Random(1234)
+    results = []
+
+    def wanted(name):
+        return not only or name in only
+
+    font_missing = None if os.path.exists(full_script.FONT_PATH) else f"font not found: {full_script.FONT_PATH} (use --font)"
+    os.chdir(workdir)
+    for n_words in sizes["words"]:
+        lyrics_text = make_lyrics(n_words, rng)
+        aligned_text = make_aligned_text(lyrics_text, breath_every=17)
+        size = {"words": n_words}
+
+        if wanted("process_texts_for_json"):
+            bench(results, "process_texts_for_json", size,
+                  lambda: full_script.process_texts_for_json(lyrics_text, aligned_text) is not None, repeat)
+        if wanted("group_json_by_sentences"):
+            full_script.save_to_json(full_script.process_texts_for_json(lyrics_text, aligned_text), "lyrics.json")
+            bench(results, "group_json_by_sentences", size,
+                  lambda: full_script.group_json_by_sentences(lyrics_text, "lyrics.json") is not None, repeat)
+        if wanted("speed_up_lyrics"):
+            full_script.save_to_json(make_sentences(lyrics_text), "sentences.json")
+            bench(results, "speed_up_lyrics", size,
+                  lambda: full_script.speed_up_lyrics("sentences.json", 1.2, "sentences_fast.json"), repeat)
+        if wanted("timeline_speed_up"):
+            timeline = Timeline.from_sentences(make_sentences(lyrics_text))
+            bench(results, "timeline_speed_up", size,
+                  lambda: len(full_script.speed_up_timeline(timeline.window(1000), 1.2)) >= 0, repeat)
+        if wanted("draw_line") and font_missing:
+            skip(results, "draw_line", size, font_missing)
+        elif wanted("draw_line"):
+            events = full_script.build_lyric_events(Timeline.from_sentences(make_sentences(lyrics_text)), 0, layout_seed=LAYOUT_SEED)
+
+            def draw_lines():
+                # Every overlay of the song, starting from an empty sprite cache
+                full_script.SPRITE_CACHE = SpriteCache(max_entries=4096)
+                for _, _, payload in events:
+                    full_script.render_lyric_overlay(payload)
+                return True
+
+            bench(results, "draw_line", size, draw_lines, repeat)
+
+    for clip_seconds in sizes["clip_seconds"]:
+        if not wanted("speed_up_audio"):
+            break
+        tone = make_tone(f"tone_{clip_seconds}.wav", clip_seconds * 1.2 + 1)
+        pcm = PCMBuffer.decode(tone, f"tone_{clip_seconds}.f32")
+        for backend in ("numpy", "atempo"):
+            bench(results, "speed_up_audio", {"clip_seconds": clip_seconds, "backend": backend},
+                  lambda: full_script.speed_up_audio(tone, 1.2, clip_seconds * 1000, backend=backend, output_file="fast.wav"), repeat)
+            bench(results, "speed_up_audio_pcm", {"clip_seconds": clip_seconds, "backend": backend},
+                  lambda: full_script.speed_up_audio(pcm, 1.2, clip_seconds * 1000, backend=backend, output_file="fast.wav"), repeat)
+
+    for n_clips in sizes["library_clips"]:
+        if not wanted("process_videos"):
+            break
+        library = make_library(f"library_{n_clips}", n_clips)
+        duration = max(2, int(n_clips * 5 / 1.2) - 1)
+        # The first run indexes and normalizes the library, later ones reuse it
+        bench(results, "process_videos_cold", {"library_clips": n_clips},
+              lambda: full_script.process_videos(library, duration, 1.2, "background.mp4"), 1)
+        bench(results, "process_videos_warm", {"library_clips": n_clips},
+              lambda: full_script.process_videos(library, duration, 1.2, "background.mp4"), repeat)
+
+    if wanted("create_lyrics_video") and font_missing:
+        for render_seconds in sizes["render_seconds"]:
+            for backend in ("pil", "ass"):
+                for name in ("create_lyrics_video", "create_lyrics_video_preview"):
+                    skip(results, name, {"render_seconds": render_seconds, "backend": backend}, font_missing)
+    elif wanted("create_lyrics_video"):
+        library = make_library("render_library", 2, seconds=max(sizes["render_seconds"]))
+        for render_seconds in sizes["render_seconds"]:
+            background = full_script.process_videos(library, render_seconds, 1.2, "render_background.mp4")
+            tone = make_tone("render_tone.wav", render_seconds)
+            lyrics_text = make_lyrics(int(render_seconds / 0.35), rng)
+            full_script.save_to_json(make_sentences(lyrics_text), "render_lyrics.json")
+            for backend in ("pil", "ass"):
+                bench(results, "create_lyrics_video", {"render_seconds": render_seconds, "backend": backend},
+                      lambda: full_script.create_lyrics_video("render_lyrics.json", background, tone, 0, 1.2, "render.mp4", backend,
+                                                              layout_seed=LAYOUT_SEED), repeat)
+                bench(results, "create_lyrics_video_preview", {"render_seconds": render_seconds, "backend": backend},
+                      lambda: full_script.create_lyrics_video("render_lyrics.json", background, tone, 0, 1.2, "preview.mp4", backend,
+                                                              preview=True, layout_seed=LAYOUT_SEED), repeat)
+
+    return results
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, results):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(result["benchmark"], json.dumps(result["size"], sort_keys=True)): result["seconds"] for result in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit')}:")
+    for result in results:
+        key = (result["benchmark"], json.dumps(result["size"], sort_keys=True))
+        before = previous.get(key)
+        if result["seconds"] is None:
+            print(f"{result['benchmark']:<28} {json.dumps(result['size']):<28} skipped in this run")
+        elif key in previous and before is None:
+            print(f"{result['benchmark']:<28} {json.dumps(result['size']):<28} skipped in baseline")
+        elif before:
+            print(f"{result['benchmark']:<28} {json.dumps(result['size']):<28} {before:>9.4f}s -> {result['seconds']:>9.4f}s  x{before / max(result['seconds'], 1e-9):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the pipeline stages")
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the results')
+    parser.add_argument('--compare', metavar='BASELINE', help='Results file of another run to compare with')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the median is reported')
+    parser.add_argument('--quick', action='store_true', help='Only the smallest size of each benchmark')
+    parser.add_argument('--only', nargs='+', help='Run only these benchmarks')
+    parser.add_argument('--font', help='Font used by the rendering benchmarks (default: FONT_PATH)')
+    parser.add_argument('--keep', action='store_true', help='Keep the fixture directory')
+    args = parser.parse_args()
+
+    if args.font:
+        full_script.FONT_PATH = os.path.abspath(args.font)
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    previous_dir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="speedup_bench_")
+    try:
+        results = run_benchmarks(workdir, QUICK_SIZES if args.quick else SIZES, args.repeat, args.only)
+    finally:
+        os.chdir(previous_dir)
+        if args.keep:
+            print(f"Fixtures kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {output}")
+    if baseline:
+        compare(baseline, results)
+
+if __name__ == "__main__":
+    main()
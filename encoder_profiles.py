@@ -0,0 +1,11 @@
+# libx264 settings by name. `threads` is per encoder: the segment profile runs
+# one narrow encoder per worker process instead of one wide encoder. Kept
+# free of imports so the CLI can check a profile name without loading the
+# renderer.
+ENCODER_PROFILES = {
+    "default": {"preset": "medium", "crf": 23, "threads": 4},
+    "fast": {"preset": "veryfast", "crf": 23, "threads": 4},
+    "quality": {"preset": "slow", "crf": 18, "threads": 8},
+    "segment": {"preset": "medium", "crf": 23, "threads": 2},
+    "preview": {"preset": "ultrafast", "crf": 30, "threads": 4},
+}
@@ -1,32 +1,49 @@
 import subprocess
 import re
 import os
-from lyrics_fetcher import fetch_and_save_lyrics
-from pydub import AudioSegment
 import glob
+import fnmatch
 import argparse
 import random
 import json
-import numpy as np
-import ffmpeg
 import textwrap
-from pydub import AudioSegment
-from PIL import Image, ImageFont, ImageDraw
-from moviepy.editor import VideoFileClip, CompositeVideoClip, AudioFileClip, ImageClip
-from moviepy.video.fx.all import resize
+from stage_scheduler import PROCESS, Stage, run_stages
+from profiling import PROFILER
+from artifact_cache import ArtifactStore, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, file_digest
+from encoder_profiles import ENCODER_PROFILES
 import traceback
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# Only the standard library and light local modules are imported up front.
+# numpy, PIL, pydub, ffmpeg-python and lyricsgenius are imported by the
+# functions that use them, so --delete or --process_videos start fast.
 
 # Constants
 SPEED_FACTOR = 1.2
 DURATION = 26
-FONT_PATH = "../Montserrat-Bold.ttf"
-VIDEO_BACKGROUND_DIR = "./video_background"
+# Resolved once so jobs running in their own working directory still find them
+FONT_PATH = os.path.abspath("../Montserrat-Bold.ttf")
+VIDEO_BACKGROUND_DIR = os.path.abspath("./video_background")
+ALIGNER_DIR = os.path.abspath("NUSAutoLyrixAlign")
+# Socket of a running alignment_service, used instead of a fresh Singularity launch when present
+ALIGNER_SOCKET = os.environ.get("SPEEDUP_ALIGNER_SOCKET")
+JOBS_DIR = "./jobs"
+ARTIFACT_CACHE_DIR = DEFAULT_CACHE_DIR
+ARTIFACT_CACHE_MAX_BYTES = DEFAULT_MAX_BYTES
 FILE_EXTENSIONS_TO_CLEAN = [".mp3", ".json"]
 FRENCH_STOPWORDS = ["le", "la", "les", "un", "une", "des", "et", "à", "de", "en", "du", "pour", "pas", "que", "qui", "ne", "se", "sur", "ce", "dans", "au", "il", "elle", "par", "avec", "est", "son", "plus", "ses", "mais", "comme", "tout", "nous", "sa", "aussi", "leur", "fait", "être", "cette", "leur", "sans", "aux", "leurs", "si", "ont", "même", "ces", "été", "ainsi", "entre", "quelle", "deux", "sont", "peut", "eux", "après", "dont", "sous", "autres", "où", "leurs", "devant", "celui", "tous", "quelques", "être", "cela", "cet", "encore", "cette", "leurs", "cette", "parce", "autre", "pendant", "alors", "depuis", "avoir", "peu", "elle", "elles", "c'était", "avant", "ainsi", "encore", "chaque", "beaucoup", "où", "tel", "telle", "tels", "telles"]
 # Word and line colors
 WORD_COLORS = ["#FFD700", "#FF6347", "#32CD32"]
 LINE_COLORS = ["#F5F5F5", "#EDEDED", "#E5E5E5", "#DCDCDC", "#D3D3D3", "#C8C8C8"]
+# Checked before a job starts, without importing the renderer
+ENCODER_PROFILE_NAMES = tuple(ENCODER_PROFILES)
+
 
+def clean_word(word):
+    from lyric_index import clean_word
+    return clean_word(word)
 
 def is_valid_word(word):
         return len(word) >= 3 and word.lower() not in FRENCH_STOPWORDS
@@ -46,18 +63,22 @@ def run_command(cmd, cmd_queue):
         cmd_queue.put((cmd, None, str(e)))
 
 
-def speed_up_audio(filename, speed_factor, duration_ms):
+def speed_up_audio(filename, speed_factor, duration_ms, start_ms=0, backend="numpy", mode="tempo", output_file="song_speed_up.wav"):
+    from audio_engine import stretch_audio_window
     try:
-        song = AudioSegment.from_file(filename)
-        song_fast = song.speedup(playback_speed=speed_factor)
-
-        # Extract a segment from the beginning to duration_ms
-        trimmed_song = song_fast[:duration_ms]
-        trimmed_song.export("song_speed_up.wav", format="wav")
+        # Only the window starting at start_ms and covering duration_ms once sped up is decoded and stretched
+        return stretch_audio_window(filename, output_file, speed_factor, duration_ms, start_ms, backend, mode)
     except Exception as e:
         print(f"Error during audio speed up: {e}")
 
-def speed_up_lyrics(filename, speed_factor):
+def speed_up_timeline(timeline, speed_factor):
+    # One vectorized rescale of the time columns
+    return timeline.scaled(speed_factor).with_texts(
+        re.sub(r'\(.*?\)', '', text) for text in timeline.texts  # remove all text between parentheses
+    )
+
+def speed_up_lyrics(filename, speed_factor, output_file="lyrics_speed_up.json"):
+    from timeline import Timeline
     try:
         with open(filename, 'r') as f:
             lyrics_data = json.load(f)
@@ -67,19 +88,7 @@ def speed_up_lyrics(filename, speed_factor):
             print('Lyrics not available for this track.')
             return False
 
-        # Iterate through each sentence
-        for sentence in lyrics_data:
-            # Iterate through each word in the sentence
-            for word_info in sentence['words']:
-                new_start_time_ms = int(word_info['startTimeMs']) / speed_factor
-                new_end_time_ms = int(word_info['endTimeMs']) / speed_factor
-                word_info['startTimeMs'] = str(max(0, int(new_start_time_ms)))
-                word_info['endTimeMs'] = str(max(0, int(new_end_time_ms)))
-                word_info['words'] = re.sub(r'\(.*?\)', '', word_info['words'])  # remove all text between parentheses
-
-        with open("/home/kathiou/sp3/lyrics_speed_up.json", 'w', encoding='utf-8') as f:
-            json.dump(lyrics_data, f, ensure_ascii=False, indent=4)
-
+        speed_up_timeline(Timeline.from_sentences(lyrics_data), speed_factor).save_json(output_file)
         return True
     except Exception as e:
         print(f"Error during lyrics speed up: {e}")
@@ -106,201 +115,215 @@ def remove_files_with_extension(extension):
 
 def cleanup_files(keep_files=None):
     if keep_files is None:
-        keep_files = ["./full_script.py", "./lyrics_fetcher.py", "./final_output.mp4", FONT_PATH, VIDEO_BACKGROUND_DIR]
+        keep_files = ["./final_output.mp4", FONT_PATH, VIDEO_BACKGROUND_DIR]
+    # The tool's own modules live next to its outputs, as do the variant renders
+    keep_patterns = ["*.py", "final_output_*.mp4"]
         
     try:
         all_files = glob.glob(os.path.join(".", "*"))
         for f in all_files:
+            if any(fnmatch.fnmatch(os.path.basename(f), pattern) for pattern in keep_patterns):
+                continue
             if f not in keep_files and os.path.isfile(f):
                 os.remove(f)
     except Exception as e:
         print(f"Error during cleanup: {e}")
 
 
-# Video Processing Module
-def process_videos(path, total_duration):
-    try:
-        files = os.listdir(path)
-        video_files = [file for file in files if file.endswith(".mp4")]
-        random.shuffle(video_files)
-
-        input_files = [ffmpeg.input(os.path.join(path, file)) for file in video_files]
-
-        filtered_files = []
-
-        for input_file in input_files:
-            v = input_file.video
-            v = v.filter('scale', 1280, 720)
-            v = v.filter('setsar', '1')  # Set the SAR to 1
-            v = v.filter_('fade', type='in', start_frame=0, nb_frames=30)
-            filtered_files.append(v)
+def remove_files(*paths):
+    # Outputs left by an earlier run in a reused workspace must not pass for fresh ones
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
 
-        v = ffmpeg.concat(*filtered_files, v=1, a=0).node
-        v = v[0].filter('setpts', 'PTS/{}'.format(SPEED_FACTOR))
 
-        out = ffmpeg.output(v, 'out.mp4', t=total_duration)
-        out = out.overwrite_output()
-        out.run()
+# Video Processing Module
+def process_videos(path, total_duration, speed_factor=SPEED_FACTOR, output_file='out.mp4'):
+    from background_library import build_background
+    # Concatenate just enough pre-normalized library clips (stream copy) to cover
+    # the clip once sped up; the speed up itself happens while rendering.
+    try:
+        return build_background(path, total_duration * speed_factor, output_file)
     except Exception as e:
         print(f"Error processing videos: {e}")
 
 # Video and Image Rendering Module
-def draw_text_with_shadow(draw, pos, text, font, fill_color, shadow_color=(0, 0, 0, 188)):
-    x, y = pos
-    shadow_offsets = [
-        (-2, -2), (0, -2), (2, -2),
-        (-2, 0),            (2, 0),
-        (-2, 2),  (0, 2),  (2, 2),
-    ]
-    
-    for offset_x, offset_y in shadow_offsets:
-        draw.text((x + offset_x, y + offset_y), text, font=font, fill=shadow_color)
-    draw.text((x, y), text, font=font, fill=fill_color)
-
-def draw_line(draw, sentence, words_info, font, y_text, current_time, color_index, line_color_index, highlighted_words_count):
-    line_words = sentence.split(" ")
-    line_width = draw.textsize(sentence, font=font)[0]
-    x_text = (1080 - line_width) / 2
-
-    word_occurrence = {}  # Dictionary to track occurrences of each word
-
-    for word in line_words:
-        if 'Ã¢ÂÂª' in word:
-            word = word.replace('Ã¢ÂÂª', '')
-
-        clean_word_in_sentence = clean_word(word)
-        if clean_word_in_sentence not in word_occurrence:
-            word_occurrence[clean_word_in_sentence] = 0
-        else:
-            word_occurrence[clean_word_in_sentence] += 1
-
-        is_highlighted = False
-        for i, word_info in enumerate(words_info):
-            start_time = int(word_info['startTimeMs']) / 1000
-            end_time = int(word_info['endTimeMs']) / 1000
-
-            clean_word_info = clean_word(word_info['words'])
-
-            # Check if the word matches by text and if the current time falls within its start and end time
-            if clean_word_in_sentence == clean_word_info and start_time <= current_time < end_time:
-                # Check if this occurrence of the word has been highlighted
-                if word_occurrence[clean_word_in_sentence] == highlighted_words_count.get((clean_word_in_sentence, start_time), 0):
-                    is_highlighted = True
-                    highlighted_words_count[(clean_word_in_sentence, start_time)] = highlighted_words_count.get((clean_word_in_sentence, start_time), 0) + 1
-                    print(f"Highlighting word: '{word}' from {start_time}s to {end_time}s")
-                    break
-
-        word_font = font
+# Draft renders for approving the timing before the full render
+PREVIEW_SIZE = (360, 640)
+PREVIEW_FPS = 12
+# Created on first draw so commands that never render do not import PIL
+SPRITE_CACHE = None
+
+def sprite_cache():
+    global SPRITE_CACHE
+    if SPRITE_CACHE is None:
+        from text_sprites import SpriteCache
+        SPRITE_CACHE = SpriteCache(max_entries=4096)
+    return SPRITE_CACHE
+
+def draw_line(image, line, slots, font_size, y_text, active_index, color_index, line_color_index):
+    from text_sprites import get_font, text_size
+    font = get_font(FONT_PATH, font_size)
+    line_width = text_size(font, line)[0]
+    x_text = (image.width - line_width) / 2
+
+    for word, word_indices in slots:
+        is_highlighted = active_index in word_indices
         fill_color = WORD_COLORS[color_index % len(WORD_COLORS)] if is_highlighted else LINE_COLORS[line_color_index % len(LINE_COLORS)]
 
-        draw_text_with_shadow(draw, (x_text, y_text), word + " ", word_font, fill_color, "black")
-        x_text += draw.textsize(word + " ", word_font)[0]
+        x_text += sprite_cache().paste(image, (x_text, y_text), word + " ", FONT_PATH, font_size, fill_color, "black")
         
-def create_lyrics_video(lyrics_file, video_file, audio_file, color_index):
+def build_lyric_events(timeline, color_index, layout_seed=None):
+    from lyric_index import SentenceIndex
+    events = []
+    line_color_index = 0
+    # A shared seed gives a preview and its full render the same font sizes
+    rng = random.Random(layout_seed)
+
+    for sentence in timeline.sentences:
+        # Sentences without timed words draw nothing; the ASS backend skips them the same way
+        if not sentence.text.strip() or not sentence.count:
+            continue
+
+        font_size = rng.randint(65, 95)
+        wrap_lines = textwrap.wrap(sentence.text, width=15)
+        index = SentenceIndex.from_columns(wrap_lines, *timeline.columns(sentence))
+
+        # Resolve the highlighted word for every word event of the sentence in one lookup
+        active_indices = index.active_words(index.starts).tolist()
+
+        for i in range(sentence.count):
+            word_start_s = index.starts[i] / 1000
+            #  Extend the word duration to the start of the next word, if there is a next word
+            if i < sentence.count - 1:
+                word_end_s = index.starts[i + 1] / 1000
+            else:
+                word_end_s = index.ends[i] / 1000
+
+            payload = (wrap_lines, index.line_slots, font_size, active_indices[i], color_index, line_color_index)
+            events.append((float(word_start_s), float(word_end_s), payload))
+        color_index += 1
+        line_color_index += 1
+
+    return events
+
+def render_lyric_overlay(payload, scale=1.0):
+    import numpy as np
+    from PIL import Image
+    from text_sprites import SHADOW_PADDING, get_font, text_size
+    wrap_lines, line_slots, font_size, active_index, color_index, line_color_index = payload
+    # The same layout shrunk for previews: the frame and font size scale, the wrapping does not
+    frame_width, frame_height = round(1080 * scale), round(1920 * scale)
+    font_size = max(1, round(font_size * scale))
+    font = get_font(FONT_PATH, font_size)
+
+    # Only the band holding the text is allocated, centered like the full frame
+    # layout; the renderer blends it at its offset
+    line_sizes = [text_size(font, line) for line in wrap_lines]
+    margin = SHADOW_PADDING + font_size // 8
+    width = min(frame_width, max(line_width for line_width, _ in line_sizes) + 2 * margin)
+    width += width % 2
+    x = (frame_width - width) // 2
+    y_text = (frame_height - len(wrap_lines) * text_size(font, "Sample text")[1]) / 2
+    y = int(y_text) - margin
+    height = int(y_text + sum(line_height for _, line_height in line_sizes)) - y + margin
+
+    image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    y_text -= y
+    for line, slots, (_, line_height) in zip(wrap_lines, line_slots, line_sizes):
+        draw_line(image, line, slots, font_size, y_text, active_index, color_index, line_color_index)
+        y_text += line_height
+
+    return np.array(image), (x, y)
+
+def create_lyrics_video(lyrics_file, video_file, audio_file, color_index, background_speed=SPEED_FACTOR, output_file='final_output.mp4', backend="pil",
+                        encoder_profile=None, segment_workers=None, preview=False, layout_seed=None, duration=None):
+    from ass_subtitles import write_ass_file
+    from timeline import Timeline
+    from video_renderer import OUTPUT_SIZE, render_ass_video, render_lyrics_frames, render_lyrics_segments
     try:
-        with open(lyrics_file) as f:
-            lyric_data = json.load(f)
-
-        line_color_index = 0
-
-        video = VideoFileClip(video_file).fx(resize, newsize=(1080, 1920))
-        audio = AudioFileClip(audio_file)
-        video = video.set_audio(audio)
-        video_duration = video.duration
-
-        font_path = FONT_PATH
-        img_clips = []
-
-        highlighted_words_count = {}  # Initialize as an empty dictionary
-
-        for sentence_data in lyric_data:
-            sentence = sentence_data['sentence']
-            words_info = sentence_data['words']
-            if not sentence.strip():
-                continue
-
-            font_size = random.randint(65, 95)
-            font = ImageFont.truetype(font_path, font_size)
-            wrap_lines = textwrap.wrap(sentence, width=15)
-
-            for i, word_info in enumerate(words_info):
-                word_start_s = int(word_info['startTimeMs']) / 1000
-                #  Extend the word duration to the start of the next word, if there is a next word
-                if i < len(words_info) - 1:
-                    next_word_start_s = int(words_info[i + 1]['startTimeMs']) / 1000
-                    word_end_s = next_word_start_s
-                else:
-                    word_end_s = int(word_info['endTimeMs']) / 1000
-
-                word_duration = word_end_s - word_start_s
-
-                image = Image.new('RGBA', (1080, 1920), (0, 0, 0, 0))
-                draw = ImageDraw.Draw(image)
-                y_text = (1920 - len(wrap_lines) * draw.textsize("Sample text", font=font)[1]) / 2
-
-                for line in wrap_lines:
-                    draw_line(draw, line, words_info, font, y_text, word_start_s, color_index, line_color_index, highlighted_words_count)
-                    y_text += draw.textsize(line, font=font)[1]
-
-                img_clip = ImageClip(np.array(image), duration=word_duration).set_position('center').set_start(word_start_s)
-                img_clips.append(img_clip)
-            color_index += 1
-            line_color_index += 1
-
-        final_clip = CompositeVideoClip([video] + img_clips, size=video.size)
-        final_clip.set_duration(video_duration).write_videofile('final_output.mp4', codec='libx264', threads=4)
+        # The pipeline hands over its timeline in memory, a path is read as sentence JSON
+        timeline = lyrics_file if isinstance(lyrics_file, Timeline) else Timeline.load_json(lyrics_file)
+        # A preview is the same render at a fraction of the size and frame rate, encoded ultrafast
+        size = PREVIEW_SIZE if preview else OUTPUT_SIZE
+        fps = PREVIEW_FPS if preview else None
+        profile = "preview" if preview else encoder_profile
+
+        if backend == "ass":
+            # libass draws the karaoke text inside the encoding ffmpeg process
+            ass_file = os.path.splitext(output_file)[0] + ".ass"
+            write_ass_file(timeline, ass_file, FONT_PATH, WORD_COLORS, LINE_COLORS, color_index, layout_seed)
+            render_ass_video(
+                video_file, audio_file, output_file, ass_file, fonts_dir=os.path.dirname(FONT_PATH),
+                size=size, profile=profile or "default", speed_factor=background_speed, fps=fps, duration=duration,
+            )
+            return output_file
+
+        events = build_lyric_events(timeline, color_index, layout_seed)
+        if preview:
+            render_lyrics_frames(
+                video_file, audio_file, output_file, events, partial(render_lyric_overlay, scale=size[0] / OUTPUT_SIZE[0]),
+                size=size, profile=profile, speed_factor=background_speed, fps=fps, duration=duration,
+            )
+            return output_file
+
+        if segment_workers and segment_workers > 1:
+            # Segments of the timeline are rendered and encoded in parallel, then joined without re-encoding
+            render_lyrics_segments(
+                video_file, audio_file, output_file, events, render_lyric_overlay,
+                profile=encoder_profile or "segment", speed_factor=background_speed, workers=segment_workers, duration=duration,
+            )
+            return output_file
+
+        # Overlays are rendered lazily as the timeline reaches them, one at a time
+        render_lyrics_frames(
+            video_file, audio_file, output_file, events, render_lyric_overlay,
+            profile=encoder_profile or "default", speed_factor=background_speed, duration=duration,
+        )
+        return output_file
 
     except Exception as e:
         print(f"Error creating lyrics video: {e}")
         traceback.print_exc()     
         
-def clean_word(word):
-    """Function to clean and standardize words for matching."""
-    # Retain hyphens but remove other non-word characters and convert to uppercase
-    return re.sub(r'[^\w\s]+', '', word.replace('-', ' ')).upper()
-
 def group_json_by_sentences(original_lyrics_text, json_file_path):
+    from lyric_matcher import format_match_stats, match_lyrics
     with open(json_file_path, 'r', encoding='utf-8') as file:
         word_timestamps = json.load(file)
 
-    original_sentences = original_lyrics_text.replace('-', ' ').split('\n')
-    sentence_structure = []
-    current_word_index = 0
-
-    for sentence in original_sentences:
-        sentence_data = {"sentence": sentence, "words": []}
-        words_in_sentence = [clean_word(word) for word in sentence.split()]
-
-        while current_word_index < len(word_timestamps) and len(sentence_data["words"]) < len(words_in_sentence):
-            word_data = word_timestamps[current_word_index]
-            clean_json_word = clean_word(word_data["words"])
-
-            if words_in_sentence[len(sentence_data["words"])] == clean_json_word:
-                sentence_data["words"].append(word_data)
-                current_word_index += 1
-            else:
-                current_word_index += 1
-
-        sentence_structure.append(sentence_data)
-
+    # Banded alignment of the lyric words against the timestamps, so a mismatch only costs that word
+    _, sentence_structure, stats = match_lyrics(original_lyrics_text, word_timestamps)
+    print(format_match_stats(stats))
     return sentence_structure
 
 
 
 # Function to run the alignment script using Singularity
 def run_alignment(input_audio, input_lyrics, output_file):
-
-    # Construct the command
-    command = f"cd NUSAutoLyrixAlign && singularity exec kaldi.simg ./RunAlignment.sh {input_audio} {input_lyrics} {output_file}"
+    from alignment_service import align_via_service
+    if ALIGNER_SOCKET and os.path.exists(ALIGNER_SOCKET):
+        try:
+            align_via_service(ALIGNER_SOCKET, input_audio, input_lyrics, output_file)
+            print(f"Alignment completed. Output file: {output_file}")
+        except Exception as e:
+            print(f"An error occurred during alignment: {e}")
+            raise PipelineError(f"Alignment failed: {e}") from e
+        return
+
+    # Construct the command, the script runs from the aligner directory so paths are made absolute
+    paths = [os.path.abspath(path) for path in (input_audio, input_lyrics, output_file)]
+    command = ["singularity", "exec", "kaldi.simg", "./RunAlignment.sh"] + paths
 
     # Execute the command
     try:
-        subprocess.run(command, shell=True, check=True)
+        subprocess.run(command, cwd=ALIGNER_DIR, check=True)
         print(f"Alignment completed. Output file: {output_file}")
     except subprocess.CalledProcessError as e:
         print(f"An error occurred during alignment: {e}")
+        raise PipelineError(f"Alignment failed: {e}") from e
 
 def cut_audio(file_name, start_time_ms, artist, title):
+    from pydub import AudioSegment
     print(f"Attempting to cut audio. Start time: {start_time_ms} ms")
     
     # Load the audio file
@@ -324,6 +347,10 @@ def is_valid_spotify_url(url):
     pattern = r'https?://open\.spotify\.com/track/[a-zA-Z0-9]+'
     return re.match(pattern, url) is not None
 
+def spotify_track_id(url):
+    match = re.match(r'https?://open\.spotify\.com/track/([a-zA-Z0-9]+)', url)
+    return match.group(1) if match else None
+
 
 def download_track(spotify_url):
     try:
@@ -380,47 +407,10 @@ def split_compound_words(word):
     return word.replace('-', ' ').split()
 
 def process_texts_for_json(original_text, aligned_text):
-    # Split the original text into words, handling compound words
-    original_words = []
-    for word in original_text.split():
-        original_words.extend(split_compound_words(word))
-
-    # Print each word from original_words for debugging
-    # print("Original Words:", original_words)
-
-    # Split the aligned text into lines and then into words and timestamps
-    aligned_lines = aligned_text.split('\n')
-    processed_lines = []
-
-    original_index = 0  # Index to keep track of position in the original text
-
-    for line in aligned_lines:
-        parts = line.split()
-        if len(parts) == 3:  # Check if the line has three parts (start time, end time, word)
-            start_time, end_time, word = parts
-
-            # Convert time from seconds to milliseconds
-            start_time_ms = str(int(float(start_time) * 1000))
-            end_time_ms = str(int(float(end_time) * 1000))
-
-            if word == 'BREATH*':
-                # Replace 'BREATH*' with the correct word from the original text in all caps
-                if original_index < len(original_words):
-                    word = original_words[original_index].upper()
-                    original_index += 1
-            else:
-                # If not 'BREATH*', just increase the index
-                original_index += 1
-            
-            # print("Processed Word:", word)
-
-            # Append the processed line to the result
-            processed_lines.append({
-                "startTimeMs": start_time_ms,
-                "words": word,
-                "endTimeMs": end_time_ms
-            })
-
+    from lyric_matcher import match_lyrics, parse_aligned_text
+    # Parse the aligned "start end WORD" lines, 'BREATH*' and misspelled entries
+    # take the lyric word they line up with
+    processed_lines, _, _ = match_lyrics(original_text, parse_aligned_text(aligned_text))
     return processed_lines
 
 # Function to save the output to a JSON file
@@ -429,20 +419,408 @@ def save_to_json(data, filename):
     with open(filename, 'w', encoding='utf-8') as file:
         json.dump(data, file, ensure_ascii=False, indent=4)
 
+class PipelineError(Exception):
+    pass
+
+class WindowAlignmentRejected(PipelineError):
+    pass
+
+def cached_stage(store, stage, track_id, params, files, produce):
+    # Restore the stage's files from the artifact store, or run it and store them
+    if store is not None:
+        meta = store.fetch(stage, track_id, params)
+        if meta is not None:
+            print(f"Reusing cached {stage} for track {track_id}")
+            PROFILER.set_counters(**{f"{stage}_cache_hit": True})
+            return meta
+    PROFILER.set_counters(**{f"{stage}_cache_hit": False})
+    meta = produce()
+    if store is not None:
+        store.put(stage, track_id, params, {path: path for path in files}, meta)
+    return meta
+
+def parse_variant(value):
+    speed, _, style = value.partition(":")
+    return float(speed), int(style) if style else None
+
+def resolve_variants(variants):
+    # Variants name their stages and outputs by speed and style, so each pair must be unique;
+    # a missing style is drawn from those not yet taken at that speed
+    for speed, style in variants:
+        if style is not None and not 0 <= style < len(WORD_COLORS):
+            raise PipelineError(f"Unknown style {style} for speed {speed:g}")
+    taken = [(speed, style) for speed, style in variants if style is not None]
+    if len(set(taken)) < len(taken):
+        raise PipelineError(f"Duplicate variants: {sorted(variant for variant in set(taken) if taken.count(variant) > 1)}")
+    resolved = []
+    for speed, style in variants:
+        if style is None:
+            free = [index for index in range(len(WORD_COLORS)) if (speed, index) not in taken]
+            if not free:
+                raise PipelineError(f"No style left for another variant at speed {speed:g}")
+            style = random.choice(free)
+            taken.append((speed, style))
+        resolved.append((speed, style))
+    return resolved
+
+def render_variant_stage(timeline_file, video_file, audio_file, color_index, speed_factor, output_file, options):
+    # Process-pool entry point rendering one variant of a multi-variant job. The
+    # render counters it sets go back to the parent's profile with the result
+    from timeline import Timeline
+    PROFILER.set_counters(speed_factor=speed_factor, color_index=color_index)
+    if not create_lyrics_video(Timeline.load(timeline_file), video_file, audio_file, color_index, speed_factor, output_file, **options):
+        raise PipelineError(f"Rendering {output_file} failed")
+    return output_file
+
+def speed_up_audio_stage(pcm_file, *args):
+    # Process-pool entry point: the worker maps the decoded track, a failed stretch fails the stage
+    from pcm_buffer import PCMBuffer
+    output_file = speed_up_audio(PCMBuffer(pcm_file), *args)
+    if not output_file:
+        raise PipelineError("Audio speed up failed")
+    return output_file
+
+def run_pipeline(url, start_time_seconds, duration_seconds=DURATION, speed_factor=SPEED_FACTOR, color_index=None,
+                 audio_backend="numpy", audio_mode="tempo", review=False, output_file="final_output.mp4", use_cache=True,
+                 alignment_mode="full", artist=None, title=None, render_backend="pil", encoder_profile=None,
+                 segment_workers=None, preview=False, preview_only=False, variants=None):
+    from lyric_matcher import format_match_stats, match_lyrics, parse_aligned_text
+    from lyrics_fetcher import fetch_and_save_lyrics
+    from pcm_buffer import PCMBuffer
+    from timeline import Timeline
+    from windowed_alignment import (AUDIO_MARGIN_MS, estimate_line_times, select_lyric_window, shift_aligned_text,
+                                    window_alignment_plausible)
+    # Every stage reads and writes relative to the current directory, which is the job's workspace
+    start_time_ms = start_time_seconds * 1000
+
+    if not is_valid_spotify_url(url):
+        raise PipelineError(f"Invalid Spotify URL: {url}")
+    if encoder_profile is not None and encoder_profile not in ENCODER_PROFILE_NAMES:
+        raise PipelineError(f"Unknown encoder profile: {encoder_profile}")
+    track_id = spotify_track_id(url)
+    # Download, lyrics and the full-song alignment only depend on the track, so
+    # renders of other cuts, speeds or styles of the same song reuse them
+    store = ArtifactStore(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES) if use_cache else None
+    downloaded_file = "song.mp3"
+    lyrics_file = "lyrics/scrapedlyrics.txt"
+    aligned_file = "lyrics_aligned.txt"
+    sentences_file = "song_sentences.timeline"
+    pcm_file = "song.f32"
+    results = {}
+
+    # One (speed factor, color index) pair per output. Download, lyrics,
+    # alignment and background are shared, so they cover the fastest variant
+    multi_variant = variants is not None
+    variants = resolve_variants([(speed_factor, color_index)] if variants is None else [tuple(variant) for variant in variants])
+    max_speed = max(speed for speed, _ in variants)
+    source_duration_ms = duration_seconds * max_speed * 1000
+    window_start_ms = max(0, start_time_ms - AUDIO_MARGIN_MS)
+    window_end_ms = start_time_ms + source_duration_ms + AUDIO_MARGIN_MS
+    window_lyrics_file = "lyrics/window_lyrics.txt"
+
+    def download():
+        # spotdl skips the download when song.mp3 is already there, and then reports no metadata
+        remove_files(downloaded_file)
+        file_name, metadata = download_track(url)
+        if not file_name or not os.path.exists(file_name):
+            raise PipelineError("No download")
+        if not metadata:
+            raise PipelineError("No metadata found.")
+        PROFILER.set_counters(bytes_downloaded=os.path.getsize(file_name))
+        return metadata
+
+    def download_stage():
+        metadata = cached_stage(store, "download", track_id, {}, [downloaded_file], download)
+        print(f"Downloaded file: {downloaded_file}")
+        print(metadata)
+        if not metadata:
+            raise PipelineError("No metadata found.")
+        return metadata
+
+    def lyrics_stage():
+        # Artist and title given with the job let the lyrics skip waiting for the download
+        metadata = {"artist": artist, "title": title} if artist and title else results["download"]
+
+        def fetch_lyrics():
+            print("Lyrics exist, fetching and saving lyrics...")
+            remove_files(lyrics_file)
+            fetch_and_save_lyrics(metadata["title"], metadata["artist"])
+            if not os.path.exists(lyrics_file):
+                raise PipelineError("Lyrics not available for this track.")
+            return {}
+
+        lyrics_params = {"artist": metadata["artist"], "title": metadata["title"]}
+        cached_stage(store, "lyrics", track_id, lyrics_params, [lyrics_file], fetch_lyrics)
+        if review:
+            input("Review the fetched lyrics and press Enter to continue...")
+
+    def decode_stage():
+        # The only decode of the track, every later audio input is a slice of it
+        pcm = PCMBuffer.decode(downloaded_file, pcm_file)
+        PROFILER.set_counters(decoded_audio_seconds=round(pcm.duration_ms / 1000, 2))
+        return pcm
+
+    def align():
+        # Run the alignment script on a lossless copy of the decoded track
+        pcm = results["decode"]
+        PROFILER.set_counters(aligned_audio_seconds=pcm.duration_ms / 1000)
+        remove_files(aligned_file)
+        run_alignment(pcm.write_wav("song.wav"), lyrics_file, aligned_file)
+        if not os.path.exists(aligned_file):
+            raise PipelineError("Alignment failed")
+        return {}
+
+    def align_window():
+        # Coarse pass: place the lyric lines over the song to pick the slice sung in the window
+        lines = read_file(lyrics_file).split('\n')
+        pcm = results["decode"]
+        line_times = estimate_line_times(lines, pcm.duration_ms)
+        window_lyrics = select_lyric_window(read_file(lyrics_file), line_times, window_start_ms, window_end_ms)
+        if not window_lyrics.strip():
+            raise WindowAlignmentRejected("no lyric lines placed in the window")
+        with open(window_lyrics_file, 'w', encoding='utf-8') as f:
+            f.write(window_lyrics)
+
+        pcm.write_wav("song_window.wav", window_start_ms, window_end_ms - window_start_ms)
+        PROFILER.set_counters(aligned_audio_seconds=(window_end_ms - window_start_ms) / 1000)
+        remove_files("lyrics_aligned_window.txt", aligned_file)
+        run_alignment("song_window.wav", window_lyrics_file, "lyrics_aligned_window.txt")
+        if not os.path.exists("lyrics_aligned_window.txt"):
+            raise PipelineError("Alignment failed")
+        with open(aligned_file, 'w', encoding='utf-8') as f:
+            f.write(shift_aligned_text(read_file("lyrics_aligned_window.txt"), window_start_ms))
+        # The slice comes from an estimate, a window that does not fit is neither used nor cached
+        entries = parse_aligned_text(read_file(aligned_file))
+        _, _, stats = match_lyrics(read_file(window_lyrics_file), entries)
+        if not window_alignment_plausible(stats, entries):
+            raise WindowAlignmentRejected(format_match_stats(stats))
+        return {}
+
+    def group(sentence_lyrics_file):
+        # Word entries and sentences come out of a single matching pass
+        entries = parse_aligned_text(read_file(aligned_file))
+        _, sentence_structure, stats = match_lyrics(read_file(sentence_lyrics_file), entries)
+        print(format_match_stats(stats))
+        PROFILER.set_counters(**{f"words_{key}": value for key, value in stats.items()})
+        timeline = Timeline.from_sentences(sentence_structure)
+        timeline.save(sentences_file)
+        return timeline
+
+    def alignment_stage():
+        inputs_params = {"audio": file_digest(downloaded_file), "lyrics": file_digest(lyrics_file)}
+        full_alignment_cached = store is not None and store.get("alignment", track_id, inputs_params) is not None
+        if alignment_mode == "window" and not full_alignment_cached:
+            # Only the rendered audio window (plus margins) is aligned, so the cost follows the clip length
+            window_params = dict(inputs_params, start_ms=window_start_ms, end_ms=window_end_ms)
+            try:
+                cached_stage(store, "window_alignment", track_id, window_params, [window_lyrics_file, aligned_file], align_window)
+                return group(window_lyrics_file)
+            except WindowAlignmentRejected as e:
+                print(f"Window alignment rejected ({e}), aligning the whole song instead")
+                PROFILER.set_counters(window_alignment_rejected=True)
+        # The whole song is aligned once, cuts are taken from the timings afterwards
+        cached_stage(store, "alignment", track_id, inputs_params, [aligned_file], align)
+        grouped = []
+
+        def group_song():
+            grouped.append(group(lyrics_file))
+            return {}
+
+        cached_stage(store, "timeline", track_id, inputs_params, [sentences_file], group_song)
+        # A cache hit restores the binary timeline instead of regrouping
+        return grouped[0] if grouped else Timeline.load(sentences_file)
+
+    def background_stage():
+        # The speed up happens while decoding at render time, so one background serves every speed
+        if not process_videos(VIDEO_BACKGROUND_DIR, duration_seconds, max_speed):
+            raise PipelineError("Background preparation failed")
+
+    # Picked once so the previews show exactly the font sizes of the full renders
+    layout_seed = random.randrange(2 ** 32)
+    background_file = os.path.abspath('out.mp4')
+    root, extension = os.path.splitext(output_file)
+
+    stages = [
+        Stage("download", download_stage),
+        Stage("lyrics", lyrics_stage, [] if artist and title else ["download"]),
+        Stage("background", background_stage),
+        Stage("decode", decode_stage, ["download"]),
+        Stage("alignment", alignment_stage, ["decode", "lyrics"]),
+    ]
+    previews, renders = [], []
+
+    def add_variant(speed, variant_color_index):
+        tag = f"_{speed:g}_{variant_color_index}" if multi_variant else ""
+        audio_file = os.path.abspath(f"song_speed_up{tag}.wav")
+        timeline_file = os.path.abspath(f"lyrics_speed_up{tag}.timeline")
+        preview_file = f"preview{tag}.mp4"
+        variant_output = f"{root}{tag}{extension}"
+
+        def timing_stage():
+            # The song timeline is cut to the clip and sped up in memory; the JSON is
+            # only written for re-rendering with --create_lyrics_video
+            timeline = speed_up_timeline(results["alignment"].window(start_time_ms, duration_seconds * speed * 1000), speed)
+            timeline.save_json(f"lyrics_speed_up{tag}.json")
+            if multi_variant:
+                timeline.save(timeline_file)  # read back by the render process
+            PROFILER.set_counters(timeline_words=len(timeline))
+            return timeline
+
+        def preview_stage():
+            if not create_lyrics_video(results[f"timing{tag}"], background_file, audio_file, variant_color_index, speed, preview_file,
+                                       render_backend, preview=True, layout_seed=layout_seed, duration=duration_seconds):
+                raise PipelineError("Preview rendering failed")
+            print(f"Preview written to {preview_file}")
+            return preview_file
+
+        def render_stage():
+            if not create_lyrics_video(results[f"timing{tag}"], background_file, audio_file, variant_color_index, speed, variant_output,
+                                       render_backend, encoder_profile, segment_workers, layout_seed=layout_seed, duration=duration_seconds):
+                raise PipelineError("Rendering failed")
+            return variant_output
+
+        # Background preparation needs nothing else and the audio stretch only the
+        # decoded track, so both overlap with lyrics fetching and alignment
+        audio_args = (os.path.abspath(pcm_file), speed, duration_seconds * 1000, start_time_ms, audio_backend, audio_mode, audio_file)
+        stages.append(Stage(f"audio{tag}", partial(speed_up_audio_stage, *audio_args), ["decode"], kind=PROCESS))
+        stages.append(Stage(f"timing{tag}", timing_stage, ["alignment"]))
+        render_deps = [f"timing{tag}", f"audio{tag}", "background"]
+        if preview or preview_only:
+            stages.append(Stage(f"preview{tag}", preview_stage, render_deps))
+            previews.append(f"preview{tag}")
+        if preview_only:
+            return
+        if multi_variant:
+            # Variants render side by side in worker processes and share the segment workers
+            variant_segment_workers = segment_workers and max(1, segment_workers // len(variants))
+            options = {"backend": render_backend, "encoder_profile": encoder_profile, "segment_workers": variant_segment_workers,
+                       "layout_seed": layout_seed, "duration": duration_seconds}
+            render = partial(render_variant_stage, timeline_file, background_file, audio_file, variant_color_index, speed,
+                             os.path.abspath(variant_output), options)
+            renders.append(Stage(f"render{tag}", render, render_deps, kind=PROCESS))
+        else:
+            renders.append(Stage("render", render_stage, render_deps))
+
+    for speed, style in variants:
+        add_variant(speed, style)
+
+    def approval_stage():
+        files = ", ".join(results[name] for name in previews)
+        answer = input(f"Review {files} and press Enter to render the full video, or type n to stop: ")
+        if answer.strip().lower().startswith("n"):
+            raise PipelineError("Preview rejected")
+
+    if previews and renders:
+        # Full renders wait for the drafts, and for their approval when reviewing
+        gate = previews
+        if review:
+            stages.append(Stage("approval", approval_stage, previews))
+            gate = ["approval"]
+        for stage in renders:
+            stage.deps += tuple(gate)
+    stages.extend(renders)
+
+    with PROFILER.stage("pipeline"):
+        run_stages(stages, results, profiler=PROFILER)
+    outputs = [results[name] for name in previews] if preview_only else [results[stage.name] for stage in renders]
+    # Several variants give a list of outputs, a single run its output file
+    return outputs if multi_variant else outputs[0]
+
+# Batch Module
+def load_manifest(manifest_path):
+    # A JSON list of {"url": ..., "start_time": seconds, "options": {...}}, "id" is optional,
+    # "artist" and "title" let the lyrics be prefetched and fetched without waiting for the download
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        jobs = json.load(f)
+    for i, job in enumerate(jobs):
+        job.setdefault("id", f"job_{i:03d}")
+        job.setdefault("options", {})
+    return jobs
+
+def run_batch_job(job, workdir, profile=False):
+    started = time.time()
+    result = {"id": job["id"], "url": job["url"], "workdir": workdir}
+    os.makedirs(workdir, exist_ok=True)
+    previous_dir = os.getcwd()
+    try:
+        os.chdir(workdir)
+        if profile:
+            PROFILER.enable()
+        output_file = run_pipeline(job["url"], int(job["start_time"]), artist=job.get("artist"), title=job.get("title"), **job["options"])
+        if isinstance(output_file, list):
+            result.update(status="ok", outputs=[os.path.join(workdir, name) for name in output_file])
+        else:
+            result.update(status="ok", output=os.path.join(workdir, output_file))
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+    finally:
+        if profile:
+            PROFILER.write()
+        os.chdir(previous_dir)
+    result["seconds"] = round(time.time() - started, 2)
+    return result
+
+def run_batch(manifest_path, jobs_dir=JOBS_DIR, workers=None, profile=False):
+    from lyrics_fetcher import prefetch_lyrics
+    jobs = load_manifest(manifest_path)
+    jobs_dir = os.path.abspath(jobs_dir)
+
+    # Warm the shared lyrics cache concurrently so jobs only read it
+    tracks = [(job["title"], job["artist"]) for job in jobs if job.get("title") and job.get("artist")]
+    if tracks:
+        prefetch_lyrics(tracks)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_batch_job, job, os.path.join(jobs_dir, job["id"]), profile) for job in jobs]
+        results = [future.result() for future in futures]
+
+    summary = {
+        "jobs": len(results),
+        "succeeded": sum(1 for result in results if result["status"] == "ok"),
+        "failed": sum(1 for result in results if result["status"] != "ok"),
+        "results": results,
+    }
+    os.makedirs(jobs_dir, exist_ok=True)
+    save_to_json(summary, os.path.join(jobs_dir, "batch_summary.json"))
+    for result in results:
+        print(f"{result['id']}: {result['status']} in {result['seconds']}s {result.get('output') or result.get('error')}")
+    print(f"{summary['succeeded']}/{summary['jobs']} jobs succeeded")
+    return summary
+
 def main():
     try:
         parser = argparse.ArgumentParser(description="Script to process videos and lyrics")
         parser.add_argument('--delete', action='store_true', help='Delete all generated files')
         parser.add_argument('--process_videos', action='store_true', help='Process videos only')
         parser.add_argument('--create_lyrics_video', action='store_true', help='Process videos only')
+        parser.add_argument('--batch', metavar='MANIFEST', help='Run every job of a JSON manifest in its own workspace')
+        parser.add_argument('--jobs_dir', default=JOBS_DIR, help='Directory holding one workspace per batch job')
+        parser.add_argument('--workers', type=int, default=None, help='Number of batch jobs run in parallel (default: CPU count)')
+        parser.add_argument('--profile', action='store_true', help='Write per-stage profile.json and a Chrome trace.json')
+        parser.add_argument('--render_backend', choices=["pil", "ass"], default="pil", help='Draw lyrics with PIL overlays or burn in an ASS karaoke script')
+        parser.add_argument('--encoder_profile', choices=ENCODER_PROFILE_NAMES, default=None,
+                            help='Name of an encoder_profiles.ENCODER_PROFILES entry (preset, crf and threads)')
+        parser.add_argument('--segment_workers', type=int, default=None, help='Render and encode the video in this many parallel segments')
+        parser.add_argument('--preview', action='store_true', help='Render a low resolution draft to approve before the full render')
+        parser.add_argument('--preview_only', action='store_true', help='Stop after the low resolution draft')
+        parser.add_argument('--variants', nargs='+', type=parse_variant, metavar='SPEED:STYLE',
+                            help='Render several outputs from one job, e.g. 1.2:0 1.35:2 (style is a WORD_COLORS index)')
         args = parser.parse_args()
 
+        if args.batch:
+            run_batch(args.batch, args.jobs_dir, args.workers, args.profile)
+            return
         if args.process_videos:
-            process_videos('./video_background', 10)  # Assuming default path and duration
+            process_videos(VIDEO_BACKGROUND_DIR, 10)  # Assuming default path and duration
             return
         if args.create_lyrics_video:
             color_index = random.randint(0, len(WORD_COLORS) - 1)
-            create_lyrics_video('/home/kathiou/sp3/lyrics_speed_up.json', 'out.mp4', 'song_speed_up.wav', color_index)
+            if args.preview or args.preview_only:
+                create_lyrics_video('lyrics_speed_up.json', 'out.mp4', 'song_speed_up.wav', color_index, output_file='preview.mp4',
+                                    backend=args.render_backend, preview=True)
+                return
+            create_lyrics_video('lyrics_speed_up.json', 'out.mp4', 'song_speed_up.wav', color_index, backend=args.render_backend,
+                                encoder_profile=args.encoder_profile, segment_workers=args.segment_workers)
             return
         if args.delete:
             cleanup_files()
@@ -451,59 +829,16 @@ def main():
         url = input("Enter a Spotify URL: ")
         duration_seconds = random.choice([DURATION])
         start_time_seconds = int(input("Enter the desired start time in seconds: "))
-        start_time_ms = start_time_seconds * 1000
-
-        if is_valid_spotify_url(url):
-            downloaded_file, metadata = download_track(url)
-            if downloaded_file:
-                print(f"Downloaded file: {downloaded_file}")
-                print(metadata)
-                if metadata:
-                    print("Lyrics exist, fetching and saving lyrics...")
-                    fetch_and_save_lyrics(metadata["title"], metadata["artist"])
-                    input("Review the fetched lyrics and press Enter to continue...")
-                else:
-                    print("No metadata found.")
-        else:
-            print("Invalid Spotify URL")
-            return
-        if downloaded_file:
-            # Cut the audio if required
-            cut_file_name = cut_audio(downloaded_file, start_time_ms, metadata["artist"], metadata["title"])
-            print(f"Processed file: {cut_file_name}")
-            cut_file_name = f"../song_cut.mp3".replace(" ", "_")
-            lyrics_file = f"../lyrics/scrapedlyrics.txt".replace(" ", "_")
-            lyrics_file_2 = f"lyrics/scrapedlyrics.txt".replace(" ", "_")
-            aligned_file = f"../lyrics_aligned.txt".replace(" ", "_")
-            aligned_file_2 = f"lyrics_aligned.txt".replace(" ", "_")
-
-            # Run the alignment script
-            run_alignment(cut_file_name, lyrics_file, aligned_file)
-            processed_lines = process_texts_for_json(read_file(lyrics_file_2), read_file(aligned_file_2))
-            #  Save the output to "lyrics.json"
-            save_to_json(processed_lines, "lyrics.json")
-            sentence_based_json = group_json_by_sentences(read_file(lyrics_file_2), "lyrics.json")
-            save_to_json(sentence_based_json, "sentence_based_lyrics.json")
-        else:
-            print("No download")
-            return
-
-        filename_lyrics = "/home/kathiou/sp3/sentence_based_lyrics.json"
-        filename_lyrics_speed_up = "/home/kathiou/sp3/lyrics_speed_up.json"
-
-        lyrics_available = speed_up_lyrics(filename_lyrics, SPEED_FACTOR)
-
-        if not lyrics_available:
-            for ext in FILE_EXTENSIONS_TO_CLEAN:
-                print("NO LYRICS WALLAH FDP")
-                # remove_files_with_extension(ext)
-            return
 
-        filename_audio = get_latest_file_with_extension(".mp3")
-        speed_up_audio(filename_audio, SPEED_FACTOR, duration_seconds * 1000)
-        process_videos(VIDEO_BACKGROUND_DIR, duration_seconds)
-        color_index = random.randint(0, len(WORD_COLORS) - 1)
-        create_lyrics_video(filename_lyrics_speed_up, 'out.mp4', 'song_speed_up.wav', color_index)
+        if args.profile:
+            PROFILER.enable()
+        try:
+            run_pipeline(url, start_time_seconds, duration_seconds, SPEED_FACTOR, review=True, render_backend=args.render_backend,
+                         encoder_profile=args.encoder_profile, segment_workers=args.segment_workers,
+                         preview=args.preview, preview_only=args.preview_only, variants=args.variants)
+        finally:
+            if args.profile:
+                PROFILER.write()
         # cleanup_files()
     except Exception as e:
         print(f"Error in main function: {e}")
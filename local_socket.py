@@ -0,0 +1,41 @@
+import json
+import os
+import socket
+import socketserver
+
+# Newline-delimited JSON over a local Unix socket, shared by the long-running
+# services and their thin clients.
+
+
+def serve_json(socket_path, handler):
+    """Return a threading Unix socket server calling `handler(request) -> response` per line."""
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    response = handler(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+def request_json(socket_path, payload, timeout=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"No response from {socket_path}")
+    return json.loads(line)
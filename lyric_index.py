@@ -0,0 +1,81 @@
+import bisect
+import re
+import numpy as np
+
+MOJIBAKE_NOTE = 'Ã¢ÂÂª'
+
+
+def clean_word(word):
+    """Function to clean and standardize words for matching."""
+    # Retain hyphens but remove other non-word characters and convert to uppercase
+    return re.sub(r'[^\w\s]+', '', word.replace('-', ' ')).upper()
+
+
+class SentenceIndex:
+    """Precomputed word lookup for one sentence.
+
+    Display words of the wrapped lines are resolved ahead of time to the timed
+    words they stand for (the n-th occurrence of a token in the sentence maps to
+    the n-th timed word with that token), so finding what to highlight at a given
+    time is a bisect over the numeric start times.
+    """
+
+    def __init__(self, lines, words_info):
+        self._build(
+            lines,
+            [word_info['words'] for word_info in words_info],
+            [int(word_info['startTimeMs']) for word_info in words_info],
+            [int(word_info['endTimeMs']) for word_info in words_info],
+        )
+
+    @classmethod
+    def from_columns(cls, lines, texts, starts, ends):
+        """Build from a timeline sentence's columns without going through word dicts."""
+        index = cls.__new__(cls)
+        index._build(lines, texts, starts, ends)
+        return index
+
+    def _build(self, lines, texts, starts, ends):
+        self.tokens = [clean_word(text) for text in texts]
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self._start_list = self.starts.tolist()
+        self._end_list = self.ends.tolist()
+
+        positions = {}
+        for i, token in enumerate(self.tokens):
+            positions.setdefault(token, []).append(i)
+
+        seen = {}
+        self.line_slots = []
+        for line in lines:
+            slots = []
+            for word in line.split(" "):
+                word = word.replace(MOJIBAKE_NOTE, '')
+                indices = []
+                # Hyphenated display words cover several timed words
+                for token in clean_word(word).split():
+                    occurrence = seen.get(token, 0)
+                    seen[token] = occurrence + 1
+                    candidates = positions.get(token, ())
+                    if occurrence < len(candidates):
+                        indices.append(candidates[occurrence])
+                slots.append((word, tuple(indices)))
+            self.line_slots.append(slots)
+
+    def active_word(self, time_ms):
+        """Index of the timed word playing at `time_ms`, or -1."""
+        i = bisect.bisect_right(self._start_list, time_ms) - 1
+        if i >= 0 and time_ms < self._end_list[i]:
+            return i
+        return -1
+
+    def active_words(self, times_ms):
+        """Vectorized active_word over an array of times."""
+        times = np.asarray(times_ms, dtype=np.int64)
+        if not len(self.starts):
+            return np.full(times.shape, -1, dtype=np.int64)
+        indices = np.searchsorted(self.starts, times, side='right') - 1
+        safe = np.maximum(indices, 0)
+        active = (indices >= 0) & (times < self.ends[safe])
+        return np.where(active, indices, -1)
@@ -0,0 +1,187 @@
+import bisect
+from lyric_index import clean_word
+
+# Banded sequence alignment between the scraped lyric words and the aligner's
+# output. Unlike a greedy walk, one mismatch cannot swallow the rest of the
+# song. Runs of words found exactly once on both sides anchor the path, so a dropped
+# verse or a truncated aligner output sits between two anchors instead of
+# pulling a global diagonal off course; between anchors the edit-distance path
+# is computed in full when small, in a band around the diagonal otherwise.
+WILDCARD = 'BREATH*'
+BAND_WIDTH = 64
+ANCHOR_WORDS = 3
+FULL_SEGMENT_CELLS = 1_000_000
+
+MATCH, DELETE, INSERT = 0, 1, 2
+# A substitution is cheaper than a gap pair but dearer than one gap, so a
+# stray aligner word is skipped rather than shifting its neighbours' timings
+SUBSTITUTION_COST = 3
+GAP_COST = 2
+
+
+def unique_anchors(source, target, wildcard=WILDCARD, size=ANCHOR_WORDS):
+    """(i, j) starts of `size`-word runs occurring once on each side, increasing on both sides."""
+    def positions(tokens):
+        found = {}
+        for i in range(len(tokens) - size + 1):
+            gram = tuple(tokens[i:i + size])
+            if wildcard not in gram:
+                found.setdefault(gram, []).append(i)
+        return found
+
+    source_positions, target_positions = positions(source), positions(target)
+    candidates = sorted((found[0], target_positions[gram][0]) for gram, found in source_positions.items()
+                        if len(found) == 1 and len(target_positions.get(gram, ())) == 1)
+
+    # Longest increasing run of target positions, out-of-order matches are dropped
+    tails, tail_indices, previous = [], [], []
+    for k, (_, j) in enumerate(candidates):
+        position = bisect.bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_indices.append(k)
+        else:
+            tails[position] = j
+            tail_indices[position] = k
+        previous.append(tail_indices[position - 1] if position else -1)
+    anchors = []
+    k = tail_indices[-1] if tail_indices else -1
+    while k >= 0:
+        anchors.append(candidates[k])
+        k = previous[k]
+    anchors.reverse()
+    return anchors
+
+
+def banded_alignment(source, target, band=BAND_WIDTH, wildcard=WILDCARD):
+    """Align two token lists, returning (i, j) pairs in order with None on the gap side.
+
+    Equal tokens and `wildcard` targets cost nothing. Word runs found once on each side
+    are matched first and the stretches between them are aligned separately.
+    """
+    pairs = []
+    first_i = first_j = 0
+    for i, j in unique_anchors(source, target, wildcard) + [(len(source), len(target))]:
+        for a, b in align_segment(source[first_i:i], target[first_j:j], band, wildcard):
+            pairs.append((None if a is None else a + first_i, None if b is None else b + first_j))
+        if i < len(source):
+            pairs.append((i, j))
+        first_i, first_j = i + 1, j + 1
+    return pairs
+
+
+def align_segment(source, target, band=BAND_WIDTH, wildcard=WILDCARD):
+    """Edit-distance alignment of one stretch, in a band of the scaled diagonal when large."""
+    n, m = len(source), len(target)
+    if n * m <= FULL_SEGMENT_CELLS:
+        band = max(n, m)
+    # The diagonal moves m/n columns per row, the band must cover that step
+    # or a row has no reachable predecessor
+    band = max(band, -(-m // max(n, 1)) + 1)
+    lows, highs = [], []
+    for i in range(n + 1):
+        center = (i * m) // n if n else m
+        lows.append(max(0, center - band))
+        highs.append(min(m, center + band))
+    if n == 0:
+        lows[0] = 0
+
+    costs, moves = [], []
+    for i in range(n + 1):
+        low, high = lows[i], highs[i]
+        row = [0] * (high - low + 1)
+        row_moves = bytearray(high - low + 1)
+        if i:
+            prev, prev_low, prev_high = costs[i - 1], lows[i - 1], highs[i - 1]
+            token = source[i - 1]
+        for j in range(low, high + 1):
+            if i == 0:
+                row[j - low] = j * GAP_COST
+                row_moves[j - low] = INSERT
+                continue
+            best, move = (n + m + 1) * SUBSTITUTION_COST, MATCH
+            if j > 0 and prev_low <= j - 1 <= prev_high:
+                other = target[j - 1]
+                best = prev[j - 1 - prev_low] + (0 if other == token or other == wildcard else SUBSTITUTION_COST)
+            if prev_low <= j <= prev_high and prev[j - prev_low] + GAP_COST < best:
+                best, move = prev[j - prev_low] + GAP_COST, DELETE
+            if j > low and row[j - 1 - low] + GAP_COST < best:
+                best, move = row[j - 1 - low] + GAP_COST, INSERT
+            row[j - low] = best
+            row_moves[j - low] = move
+        costs.append(row)
+        moves.append(row_moves)
+
+    pairs = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        move = moves[i][j - lows[i]]
+        if i > 0 and j > 0 and move == MATCH:
+            i, j = i - 1, j - 1
+            pairs.append((i, j))
+        elif i > 0 and move == DELETE:
+            i -= 1
+            pairs.append((i, None))
+        else:
+            j -= 1
+            pairs.append((None, j))
+    pairs.reverse()
+    return pairs
+
+
+def parse_aligned_text(aligned_text):
+    # "start end WORD" lines in seconds to the lyrics.json entry format
+    entries = []
+    for line in aligned_text.split('\n'):
+        parts = line.split()
+        if len(parts) == 3:  # Check if the line has three parts (start time, end time, word)
+            start_time, end_time, word = parts
+            entries.append({
+                "startTimeMs": str(int(float(start_time) * 1000)),
+                "words": word,
+                "endTimeMs": str(int(float(end_time) * 1000)),
+            })
+    return entries
+
+
+def match_lyrics(original_text, entries, band=BAND_WIDTH):
+    """Match lyric lines against aligned word entries in one pass.
+
+    Returns the entries (wildcards and substitutions renamed to the lyric word),
+    the sentence structure and match/gap statistics.
+    """
+    sentences = [{"sentence": line, "words": []} for line in original_text.replace('-', ' ').split('\n')]
+    lyric_words = []
+    for line_number, sentence_data in enumerate(sentences):
+        for word in sentence_data["sentence"].split():
+            token = clean_word(word)
+            if token:
+                lyric_words.append((line_number, word, token))
+
+    entries = [dict(entry) for entry in entries]
+    aligned_tokens = [WILDCARD if entry["words"] == WILDCARD else clean_word(entry["words"]) for entry in entries]
+    pairs = banded_alignment([token for _, _, token in lyric_words], aligned_tokens, band)
+
+    stats = {"lyric_words": len(lyric_words), "aligned_words": len(entries),
+             "matched": 0, "filled": 0, "substituted": 0, "missing": 0, "extra": 0}
+    for i, j in pairs:
+        if i is None:
+            stats["extra"] += 1
+            continue
+        if j is None:
+            stats["missing"] += 1
+            continue
+        line_number, word, token = lyric_words[i]
+        entry = entries[j]
+        if aligned_tokens[j] == token:
+            stats["matched"] += 1
+        else:
+            stats["filled" if aligned_tokens[j] == WILDCARD else "substituted"] += 1
+            entry["words"] = word.upper()
+        sentences[line_number]["words"].append(entry)
+    return entries, sentences, stats
+
+
+def format_match_stats(stats):
+    return (f"Matched {stats['matched']}/{stats['lyric_words']} lyric words against {stats['aligned_words']} aligned "
+            f"({stats['filled']} filled, {stats['substituted']} substituted, {stats['missing']} missing, {stats['extra']} extra)")
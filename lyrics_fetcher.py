@@ -1,13 +1,20 @@
 import os
 import re
+import json
+import hashlib
+import threading
+import time
 import lyricsgenius
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
-def save_lyrics_to_file(lyrics, song_name, artist_name):
-    folder_path = 'lyrics'
-    os.makedirs(folder_path, exist_ok=True)
-    filename = "scrapedlyrics.txt"
-    file_path = os.path.join(folder_path, filename)
+LYRICS_CACHE_DIR = os.environ.get("LYRICS_CACHE_DIR") or os.path.expanduser("~/.cache/speedupmaker/lyrics")
+# Directory of "<artist> - <title>.txt" files used instead of Genius when set (offline runs)
+LOCAL_LYRICS_DIR = os.environ.get("SPEEDUP_LYRICS_DIR")
+GENIUS_RATE_PER_SECOND = 2.0
+
+def save_lyrics_to_file(lyrics, song_name, artist_name, file_path=os.path.join('lyrics', 'scrapedlyrics.txt')):
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
 
     lyrics = preprocess_lyrics(lyrics)
     with open(file_path, 'w') as file:
@@ -36,26 +43,128 @@ def find_start_index(lyrics):
     print("No specific section label found. Using entire lyrics.")
     return 0
 
-def fetch_lyrics(song_name, artist_name, access_token):
-    genius = lyricsgenius.Genius(access_token)
-    try:
-        song = genius.search_song(song_name, artist_name)
-        return song
-    except Exception as e:
-        print(f"Error fetching lyrics: {e}")
-        return None
+def normalize_key(song_name, artist_name):
+    # Case, accents and punctuation do not make a different song
+    key = f"{artist_name}\n{song_name}"
+    key = unicodedata.normalize('NFKD', key).encode('ascii', 'ignore').decode('ascii').lower()
+    return '\n'.join(' '.join(re.sub(r'[^a-z0-9]+', ' ', part).split()) for part in key.split('\n'))
+
+class RateLimiter:
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class GeniusProvider:
+    def __init__(self, access_token, rate_per_second=GENIUS_RATE_PER_SECOND):
+        # One client, and so one HTTP session, for every lookup
+        self.genius = lyricsgenius.Genius(access_token)
+        self.rate_limiter = RateLimiter(rate_per_second)
+
+    def fetch(self, song_name, artist_name):
+        self.rate_limiter.wait()
+        song = self.genius.search_song(song_name, artist_name)
+        return song.lyrics if song else None
+
+class LocalLyricsProvider:
+    """Stand-in provider reading "<artist> - <title>.txt" files, for offline runs and tests."""
+
+    def __init__(self, directory):
+        self.files = {}
+        for filename in os.listdir(directory):
+            artist_name, _, song_name = os.path.splitext(filename)[0].partition(" - ")
+            self.files[normalize_key(song_name, artist_name)] = os.path.join(directory, filename)
+
+    def fetch(self, song_name, artist_name):
+        file_path = self.files.get(normalize_key(song_name, artist_name))
+        if not file_path:
+            return None
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return file.read()
+
+class CachedLyricsProvider:
+    """On-disk cache in front of another provider, keyed by normalized (artist, title)."""
+
+    def __init__(self, provider, cache_dir=LYRICS_CACHE_DIR):
+        self.provider = provider
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
 
-def fetch_and_save_lyrics(song_name, artist_name):
-    access_token = os.getenv('GENIUS_ACCESS_TOKEN')
-    if not access_token:
+    def _cache_path(self, song_name, artist_name):
+        digest = hashlib.sha256(normalize_key(song_name, artist_name).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def fetch(self, song_name, artist_name):
+        cache_path = self._cache_path(song_name, artist_name)
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as file:
+                return json.load(file)["lyrics"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        lyrics = self.provider.fetch(song_name, artist_name)
+        # Misses are not cached, they are often rate limits or transient errors
+        if lyrics:
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump({"artist": artist_name, "title": song_name, "lyrics": lyrics}, file, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        return lyrics
+
+_default_provider = None
+
+def default_lyrics_provider():
+    global _default_provider
+    if _default_provider is None:
+        if LOCAL_LYRICS_DIR:
+            _default_provider = CachedLyricsProvider(LocalLyricsProvider(LOCAL_LYRICS_DIR))
+        else:
+            access_token = os.getenv('GENIUS_ACCESS_TOKEN')
+            if not access_token:
+                return None
+            _default_provider = CachedLyricsProvider(GeniusProvider(access_token))
+    return _default_provider
+
+def prefetch_lyrics(tracks, provider=None, max_workers=4):
+    """Warm the lyrics cache for many (song_name, artist_name) pairs concurrently."""
+    provider = provider or default_lyrics_provider()
+    if provider is None:
+        print("Genius API token not found.")
+        return {}
+
+    def fetch_one(track):
+        try:
+            return provider.fetch(*track)
+        except Exception as e:
+            print(f"Error fetching lyrics for {track[0]} by {track[1]}: {e}")
+            return None
+
+    tracks = list(dict.fromkeys(tracks))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(tracks, pool.map(fetch_one, tracks)))
+
+def fetch_and_save_lyrics(song_name, artist_name, provider=None):
+    provider = provider or default_lyrics_provider()
+    if provider is None:
         print("Genius API token not found.")
         return
 
-    print(f"Fetching lyrics for {song_name} by {artist_name} with token: {access_token}")
-    song = fetch_lyrics(song_name, artist_name, access_token)
-    if song:
+    print(f"Fetching lyrics for {song_name} by {artist_name}")
+    try:
+        lyrics = provider.fetch(song_name, artist_name)
+    except Exception as e:
+        print(f"Error fetching lyrics: {e}")
+        lyrics = None
+    if lyrics:
         print(f"Lyrics found for {song_name} by {artist_name}")
-        save_lyrics_to_file(song.lyrics, song_name, artist_name)
+        save_lyrics_to_file(lyrics, song_name, artist_name)
     else:
         print(f"Lyrics not found for {song_name} by {artist_name}.")
-
@@ -0,0 +1,53 @@
+import subprocess
+import numpy as np
+from audio_engine import CHANNELS, SAMPLE_RATE, write_wav
+
+# Decode-once audio: the downloaded track is decoded a single time to raw
+# float32 PCM on disk and memory-mapped. Alignment input, the stretch window
+# and any other cut are zero-copy slices of that map, so the mp3 is never
+# decoded again and nothing is re-encoded before the final mux.
+
+
+class PCMBuffer:
+    """Float32 PCM of a whole track, memory-mapped from a raw f32le file."""
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # Opening the map is cheap, so worker processes reopen it from the path
+        self.samples = np.memmap(path, dtype='<f4', mode='r').reshape(-1, channels)
+
+    @classmethod
+    def decode(cls, filename, path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        command = [
+            "ffmpeg", "-v", "error", "-y", "-i", filename,
+            "-f", "f32le", "-ac", str(channels), "-ar", str(sample_rate), path,
+        ]
+        subprocess.run(command, check=True)
+        return cls(path, sample_rate, channels)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration_ms(self):
+        return len(self.samples) * 1000 / self.sample_rate
+
+    def _frame(self, ms):
+        return min(max(int(round(ms * self.sample_rate / 1000)), 0), len(self.samples))
+
+    def slice_ms(self, start_ms, duration_ms=None):
+        """View (no copy) of `duration_ms` from `start_ms`, or to the end of the track."""
+        start = self._frame(start_ms)
+        end = len(self.samples) if duration_ms is None else self._frame(start_ms + duration_ms)
+        return self.samples[start:end]
+
+    def write_wav(self, output_file, start_ms=0, duration_ms=None):
+        # Lossless 16-bit wav for tools that need a file, such as the aligner
+        write_wav(output_file, self.slice_ms(start_ms, duration_ms), self.sample_rate)
+        return output_file
+
+    def ffmpeg_input_args(self):
+        """ffmpeg input options reading the raw PCM directly, -ss/-t can go in front."""
+        return ["-f", "f32le", "-ar", str(self.sample_rate), "-ac", str(self.channels), "-i", self.path]
@@ -0,0 +1,143 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage instrumentation: wall time, CPU time and stage counters, written
+# as JSON and as a Chrome trace (chrome://tracing, Perfetto) with --profile.
+# Disabled, every call is a no-op.
+#
+# Thread stages share the process, so only their wall and thread CPU time are
+# their own; child process CPU and peak RSS are reported once for the whole
+# process. A stage in a pool worker has the worker to itself and brings back
+# its CPU, its children's CPU and the worker's peak RSS (see run_measured).
+
+
+def _children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+class Profiler:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._active = threading.local()
+
+    def enable(self):
+        self.enabled = True
+        self.records = []
+        self.origin = time.perf_counter()
+
+    def _stack(self):
+        if not hasattr(self._active, "stack"):
+            self._active.stack = []
+        return self._active.stack
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage `name`; set_counters() inside it attaches to it."""
+        if not self.enabled:
+            yield
+            return
+        record = {"name": name, "counters": {}, "tid": threading.get_ident()}
+        stack = self._stack()
+        stack.append(record)
+        start = time.perf_counter()
+        thread_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            record.update(
+                start=start - self.origin,
+                wall_seconds=round(end - start, 4),
+                cpu_seconds=round(time.thread_time() - thread_cpu, 4),
+            )
+            with self._lock:
+                self.records.append(record)
+
+    def record(self, name, start, end, counters=None, **measurements):
+        """Add a stage timed elsewhere, e.g. one that ran in another process."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.records.append(dict(
+                measurements, name=name, counters=dict(counters or {}), tid=threading.get_ident(),
+                start=start - self.origin, wall_seconds=round(end - start, 4),
+            ))
+
+    def set_counters(self, **counters):
+        """Attach counters to the innermost stage running in this thread."""
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if stack:
+            stack[-1]["counters"].update(counters)
+
+    def process_usage(self):
+        return {
+            "children_cpu_seconds": round(_children_cpu_seconds(), 4),
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+            "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+
+    def summary(self):
+        return {"pid": os.getpid(), "process": self.process_usage(),
+                "stages": sorted(self.records, key=lambda record: record["start"])}
+
+    def chrome_trace(self):
+        events = []
+        for record in self.records:
+            args = {key: value for key, value in record.items() if key not in ("name", "tid", "start", "counters")}
+            args.update(record["counters"])
+            events.append({
+                "name": record["name"], "ph": "X", "pid": os.getpid(), "tid": record["tid"],
+                "ts": int(record["start"] * 1e6), "dur": int(record["wall_seconds"] * 1e6), "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, json_path="profile.json", trace_path="trace.json"):
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=4)
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+        print(f"Profile written to {json_path} and {trace_path}")
+
+
+PROFILER = Profiler()
+
+
+def run_measured(func):
+    """Run a stage in a pool worker and return (result, measurements, counters).
+
+    The worker runs one stage at a time, so its CPU and child usage over the
+    call belong to the stage; counters set inside it are collected as well.
+    """
+    PROFILER.enable()
+    record = {"counters": {}}
+    stack = PROFILER._stack()
+    stack.append(record)
+    cpu = time.process_time()
+    children_cpu = _children_cpu_seconds()
+    try:
+        result = func()
+    finally:
+        stack.pop()
+    measurements = {
+        "cpu_seconds": round(time.process_time() - cpu, 4),
+        "children_cpu_seconds": round(_children_cpu_seconds() - children_cpu, 4),
+        "worker_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "worker_pid": os.getpid(),
+    }
+    return result, measurements, record["counters"]
@@ -0,0 +1,141 @@
+import argparse
+import importlib
+import json
+import os
+import threading
+import time
+from local_socket import request_json, serve_json
+
+# Long-running render worker. Heavy modules, fonts and the sprite cache stay
+# loaded between jobs, so short preview jobs skip interpreter start up and
+# imports. Jobs run one at a time because the pipeline works in the current
+# directory. The client half of this file only needs the standard library.
+DEFAULT_SOCKET = os.environ.get("SPEEDUP_RENDER_SOCKET", "/tmp/speedupmaker_render.sock")
+WARM_FONT_SIZES = range(65, 96)
+WARM_MODULES = [
+    "alignment_service", "ass_subtitles", "audio_engine", "background_library", "lyric_matcher",
+    "lyrics_fetcher", "timeline", "video_renderer", "windowed_alignment",
+]
+
+
+class RenderDaemon:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs_served = 0
+        self.started = time.time()
+        self.server = None
+
+    def warm(self):
+        started = time.perf_counter()
+        import full_script
+        from text_sprites import get_font
+        # Everything a pipeline run imports lazily, loaded once here
+        for module in WARM_MODULES:
+            importlib.import_module(module)
+
+        if os.path.exists(full_script.FONT_PATH):
+            for font_size in WARM_FONT_SIZES:
+                get_font(full_script.FONT_PATH, font_size)
+        full_script.sprite_cache()
+        print(f"Render daemon warmed up in {time.perf_counter() - started:.2f}s")
+
+    def status(self):
+        import full_script
+        cache = full_script.sprite_cache()
+        return {
+            "ok": True,
+            "jobs_served": self.jobs_served,
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "sprite_cache": {"entries": len(cache), "hits": cache.hits, "misses": cache.misses},
+        }
+
+    def run_job(self, request):
+        import full_script
+        job = {"id": request.get("id", "daemon"), "url": request["url"], "start_time": request["start_time"],
+               "artist": request.get("artist"), "title": request.get("title"), "options": request.get("options", {})}
+        with self.lock:
+            result = full_script.run_batch_job(job, request["workdir"], request.get("profile", False))
+            self.jobs_served += 1
+        return dict(result, ok=result["status"] == "ok")
+
+    def render(self, request):
+        import full_script
+        with self.lock:
+            output_file = full_script.create_lyrics_video(
+                request["lyrics"], request["video"], request["audio"], request.get("color_index", 0),
+                request.get("speed_factor", full_script.SPEED_FACTOR), request["output"], **request.get("options", {}),
+            )
+            self.jobs_served += 1
+        if not output_file:
+            return {"ok": False, "error": "Rendering failed"}
+        return {"ok": True, "output": output_file}
+
+    def handle(self, request):
+        command = request.get("command")
+        if command == "pipeline":
+            return self.run_job(request)
+        if command == "render":
+            return self.render(request)
+        if command == "ping":
+            return self.status()
+        if command == "stop":
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown command: {command}"}
+
+    def serve(self, socket_path):
+        self.warm()
+        self.server = serve_json(socket_path, self.handle)
+        print(f"Render daemon listening on {socket_path}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm render daemon and its client")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket of the daemon')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('serve', help='Run the daemon in the foreground')
+    commands.add_parser('ping', help='Show daemon status')
+    commands.add_parser('stop', help='Stop the daemon')
+    pipeline = commands.add_parser('pipeline', help='Run the full pipeline for a track in a workspace')
+    pipeline.add_argument('url')
+    pipeline.add_argument('start_time', type=int)
+    pipeline.add_argument('--workdir', default='.', help='Job workspace (default: current directory)')
+    pipeline.add_argument('--artist')
+    pipeline.add_argument('--title')
+    pipeline.add_argument('--options', default='{}', help='JSON object of run_pipeline keyword arguments')
+    pipeline.add_argument('--profile', action='store_true', help='Write profile.json and trace.json in the workspace')
+    render = commands.add_parser('render', help='Render lyrics over a prepared background and audio')
+    render.add_argument('lyrics')
+    render.add_argument('video')
+    render.add_argument('audio')
+    render.add_argument('--output', default='final_output.mp4')
+    render.add_argument('--color_index', type=int, default=0)
+    render.add_argument('--speed_factor', type=float, default=1.2, help='Speed the background was prepared for')
+    render.add_argument('--options', default='{}', help='JSON object of create_lyrics_video keyword arguments')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        RenderDaemon().serve(args.socket)
+        return
+
+    if args.command == 'pipeline':
+        request = {"command": "pipeline", "url": args.url, "start_time": args.start_time, "workdir": os.path.abspath(args.workdir),
+                   "artist": args.artist, "title": args.title, "options": json.loads(args.options), "profile": args.profile}
+    elif args.command == 'render':
+        request = {"command": "render", "lyrics": os.path.abspath(args.lyrics), "video": os.path.abspath(args.video),
+                   "audio": os.path.abspath(args.audio), "output": os.path.abspath(args.output),
+                   "color_index": args.color_index, "speed_factor": args.speed_factor, "options": json.loads(args.options)}
+    else:
+        request = {"command": args.command}
+    response = request_json(args.socket, request)
+    print(json.dumps(response, indent=4))
+    if not response.get("ok"):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
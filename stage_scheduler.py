@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from profiling import run_measured
+
+# Runs a pipeline expressed as a dependency graph of stages. A stage starts as
+# soon as the stages it depends on have finished, on a thread pool for
+# subprocess- and IO-bound work or a process pool for CPU-bound work.
+THREAD = "thread"
+PROCESS = "process"
+
+
+def process_context():
+    # Workers come from a forkserver rather than being forked from this
+    # process, which has stage threads running (see cpython #90622)
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class Stage:
+    """A zero-argument callable plus the names of the stages it must run after.
+
+    Process stages must be picklable (a top-level function or a functools.partial
+    of one). Thread stages read their inputs from the shared results dict.
+    """
+
+    def __init__(self, name, func, deps=(), kind=THREAD):
+        if kind not in (THREAD, PROCESS):
+            raise ValueError(f"Unknown stage kind: {kind}")
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.kind = kind
+
+
+class StageError(Exception):
+    def __init__(self, stage, error):
+        super().__init__(f"Stage {stage} failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+def _profiled(profiler, name, func):
+    with profiler.stage(name):
+        return func()
+
+
+def run_stages(stages, results=None, max_threads=None, max_processes=None, profiler=None):
+    """Run every stage once its dependencies are done and return {name: result}.
+
+    Results are stored in `results` as stages finish, so stages running in
+    threads can read what their dependencies produced. The first failure stops
+    scheduling, cancels stages not yet started and is raised as a StageError.
+    With a `profiler`, thread stages are profiled where they run and process
+    stages are timed from submission to completion, with the CPU, child usage
+    and counters their worker measured.
+    """
+    results = {} if results is None else results
+    names = [stage.name for stage in stages]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate stage names: {duplicates}")
+    pending = {stage.name: stage for stage in stages}
+    kinds = {stage.name: stage.kind for stage in stages}
+    for stage in stages:
+        unknown = [dep for dep in stage.deps if dep not in pending]
+        if unknown:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {unknown}")
+
+    # Pools are created before any stage runs, the process pool with no more
+    # workers than there are process stages
+    pools = {}
+    process_stages = sum(stage.kind == PROCESS for stage in stages)
+    if process_stages:
+        workers = min(process_stages, max_processes or os.cpu_count() or 1)
+        pools[PROCESS] = ProcessPoolExecutor(max_workers=workers, mp_context=process_context())
+    if process_stages < len(stages):
+        pools[THREAD] = ThreadPoolExecutor(max_workers=max_threads)
+    running = {}
+    started = {}
+    try:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.deps):
+                    if profiler is not None and stage.kind == THREAD:
+                        future = pools[stage.kind].submit(_profiled, profiler, name, stage.func)
+                    elif profiler is not None:
+                        future = pools[stage.kind].submit(run_measured, stage.func)
+                    else:
+                        future = pools[stage.kind].submit(stage.func)
+                    running[future] = name
+                    started[name] = time.perf_counter()
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Stages with circular dependencies: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    if profiler is not None and kinds[name] == PROCESS:
+                        results[name], measurements, counters = future.result()
+                        profiler.record(name, started[name], time.perf_counter(), counters, **measurements)
+                    else:
+                        results[name] = future.result()
+                except Exception as e:
+                    for other in running:
+                        other.cancel()
+                    raise StageError(name, e) from e
+    finally:
+        # Stages already running are waited for so none outlives the pipeline
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+    return results
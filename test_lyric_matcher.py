@@ -0,0 +1,69 @@
+import random
+from lyric_matcher import BAND_WIDTH, WILDCARD, banded_alignment, match_lyrics
+
+
+def entry(word, start_ms):
+    return {"startTimeMs": str(start_ms), "words": word, "endTimeMs": str(start_ms + 200)}
+
+
+def test_empty_inputs():
+    assert banded_alignment([], []) == []
+    assert banded_alignment(["A", "B"], []) == [(0, None), (1, None)]
+    assert banded_alignment([], ["A", "B"]) == [(None, 0), (None, 1)]
+
+
+def test_skewed_lengths_stay_inside_the_band():
+    target = [f"W{k}" for k in range(300)]
+    pairs = banded_alignment(["W150"], target, band=4)
+    assert [pair for pair in pairs if pair[0] is not None] == [(0, 150)]
+    assert len(pairs) == 300
+
+    pairs = banded_alignment(target, ["W0"], band=4)
+    assert (0, 0) in pairs
+    assert len(pairs) == 300
+
+
+def test_wildcards_fill_lyric_words():
+    entries, sentences, stats = match_lyrics("one two three", [entry("ONE", 0), entry(WILDCARD, 300), entry("THREE", 600)])
+    assert [e["words"] for e in entries] == ["ONE", "TWO", "THREE"]
+    assert stats["matched"] == 2 and stats["filled"] == 1
+    assert len(sentences[0]["words"]) == 3
+
+
+def test_missing_chunk_keeps_later_timings():
+    lyrics = "\n".join(" ".join(f"w{k}x{i}" for i in range(4)) for k in range(40))
+    lyric_tokens = [word.upper() for line in lyrics.split("\n") for word in line.split()]
+    # The aligner lost a chunk of 20 words in the middle of the song
+    aligned = [entry(token, k * 100) for k, token in enumerate(lyric_tokens) if not 60 <= k < 80]
+    entries, sentences, stats = match_lyrics(lyrics, aligned)
+    assert stats["missing"] == 20
+    assert stats["matched"] == len(aligned)
+    assert stats["extra"] == 0
+    assert [e["words"] for e in sentences[39]["words"]] == ["W39X0", "W39X1", "W39X2", "W39X3"]
+    assert all(sentences[k]["words"] == [] for k in range(15, 20))
+
+
+def repetitive_lyrics(n_words):
+    # A small vocabulary repeats single words everywhere, as real lyrics do
+    rng = random.Random(7)
+    words = [f"v{rng.randrange(200)}" for _ in range(n_words)]
+    return "\n".join(" ".join(words[k:k + 8]) for k in range(0, n_words, 8)), [word.upper() for word in words]
+
+
+def test_gap_wider_than_the_band():
+    lyrics, tokens = repetitive_lyrics(2000)
+    aligned = [entry(token, k * 100) for k, token in enumerate(tokens) if not 500 <= k < 500 + 4 * BAND_WIDTH]
+    _, _, stats = match_lyrics(lyrics, aligned)
+    assert stats["missing"] == 4 * BAND_WIDTH
+    assert stats["matched"] == len(aligned)
+    assert stats["substituted"] == 0
+
+
+def test_truncated_aligner_output():
+    lyrics, tokens = repetitive_lyrics(2000)
+    aligned = [entry(token, k * 100) for k, token in enumerate(tokens[:1200])]
+    entries, sentences, stats = match_lyrics(lyrics, aligned)
+    assert stats["matched"] == 1200
+    assert stats["missing"] == 800
+    assert [e["startTimeMs"] for e in entries] == [str(k * 100) for k in range(1200)]
+    assert sentences[-1]["words"] == []
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image, ImageFont, ImageDraw
+
+# Pre-rendered word bitmaps: each word is rasterized (shadow + fill) once and
+# then only pasted when a line is drawn.
+SHADOW_OFFSETS = [
+    (-2, -2), (0, -2), (2, -2),
+    (-2, 0),            (2, 0),
+    (-2, 2),  (0, 2),  (2, 2),
+]
+SHADOW_PADDING = 2
+
+_measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+
+
+@lru_cache(maxsize=64)
+def get_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=8192)
+def text_size(font, text):
+    return _measure_draw.textsize(text, font=font)
+
+
+def draw_text_with_shadow(draw, pos, text, font, fill_color, shadow_color=(0, 0, 0, 188)):
+    x, y = pos
+    for offset_x, offset_y in SHADOW_OFFSETS:
+        draw.text((x + offset_x, y + offset_y), text, font=font, fill=shadow_color)
+    draw.text((x, y), text, font=font, fill=fill_color)
+
+
+def render_sprite(text, font, fill_color, shadow_color):
+    _, _, right, bottom = font.getbbox(text)
+    width = max(right, 0) + 2 * SHADOW_PADDING
+    height = max(bottom, 0) + 2 * SHADOW_PADDING
+    image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw_text_with_shadow(ImageDraw.Draw(image), (SHADOW_PADDING, SHADOW_PADDING), text, font, fill_color, shadow_color)
+    return image
+
+
+class SpriteCache:
+    """Bounded LRU of rendered word sprites keyed by text, font and colors."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._sprites = OrderedDict()
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def get(self, text, font_path, font_size, fill_color, shadow_color="black"):
+        key = (text, font_path, font_size, fill_color, shadow_color)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            self.hits += 1
+            return sprite
+
+        self.misses += 1
+        font = get_font(font_path, font_size)
+        sprite = (render_sprite(text, font, fill_color, shadow_color), text_size(font, text)[0])
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.max_entries:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def paste(self, image, pos, text, font_path, font_size, fill_color, shadow_color="black"):
+        """Paste a cached sprite with its text origin at `pos` and return the advance width."""
+        sprite, advance = self.get(text, font_path, font_size, fill_color, shadow_color)
+        left, top = int(round(pos[0])) - SHADOW_PADDING, int(round(pos[1])) - SHADOW_PADDING
+        # Composited rather than pasted with its own mask, which would square the
+        # alpha of antialiased and shadow edges; the box is clipped to the image
+        source = (max(-left, 0), max(-top, 0), min(sprite.width, image.width - left), min(sprite.height, image.height - top))
+        if source[0] < source[2] and source[1] < source[3]:
+            image.alpha_composite(sprite, (max(left, 0), max(top, 0)), source)
+        return advance
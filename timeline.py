@@ -0,0 +1,143 @@
+import json
+import struct
+import numpy as np
+
+# In-memory lyric timeline shared by the pipeline stages. Word times live in
+# two int64 columns and texts in a parallel list; sentences are slices of
+# them. Scaling or windowing the timeline is a handful of array operations,
+# and the sentence JSON ({"sentence", "words": [{"startTimeMs", ...}]}) is only
+# an import/export format.
+MAGIC = b"LTL1"
+HEADER = struct.Struct("<4sII")
+SEPARATOR = "\x00"
+
+
+class Word:
+    __slots__ = ("text", "start_ms", "end_ms")
+
+    def __init__(self, text, start_ms, end_ms):
+        self.text = text
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+
+    def to_dict(self):
+        return {"startTimeMs": str(self.start_ms), "words": self.text, "endTimeMs": str(self.end_ms)}
+
+
+class Sentence:
+    """A sentence and the slice [first, first + count) of the word columns it owns."""
+    __slots__ = ("text", "first", "count")
+
+    def __init__(self, text, first, count):
+        self.text = text
+        self.first = first
+        self.count = count
+
+
+class Timeline:
+    __slots__ = ("sentences", "texts", "starts", "ends")
+
+    def __init__(self, sentences, texts, starts, ends):
+        self.sentences = sentences
+        self.texts = texts
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def from_counts(cls, sentence_texts, counts, texts, starts, ends):
+        firsts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(counts) else []
+        sentences = [Sentence(text, int(first), int(count)) for text, first, count in zip(sentence_texts, firsts, counts)]
+        return cls(sentences, texts, starts, ends)
+
+    @classmethod
+    def from_sentences(cls, data):
+        sentence_texts, counts, texts, starts, ends = [], [], [], [], []
+        for sentence_data in data:
+            sentence_texts.append(sentence_data["sentence"])
+            counts.append(len(sentence_data["words"]))
+            for word_info in sentence_data["words"]:
+                texts.append(word_info["words"])
+                starts.append(int(word_info["startTimeMs"]))
+                ends.append(int(word_info["endTimeMs"]))
+        return cls.from_counts(sentence_texts, counts, texts, starts, ends)
+
+    def to_sentences(self):
+        return [{"sentence": sentence.text, "words": [word.to_dict() for word in self.words(sentence)]} for sentence in self.sentences]
+
+    @classmethod
+    def load_json(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_sentences(json.load(f))
+
+    def save_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_sentences(), f, ensure_ascii=False, indent=4)
+        return path
+
+    def columns(self, sentence):
+        """Texts, starts and ends of one sentence's words (the arrays are views)."""
+        stop = sentence.first + sentence.count
+        return self.texts[sentence.first:stop], self.starts[sentence.first:stop], self.ends[sentence.first:stop]
+
+    def words(self, sentence):
+        texts, starts, ends = self.columns(sentence)
+        return [Word(text, start, end) for text, start, end in zip(texts, starts.tolist(), ends.tolist())]
+
+    def scaled(self, speed_factor):
+        # Same truncation and clamping as the JSON speed up did per word
+        starts = np.maximum(0, (self.starts / speed_factor).astype(np.int64))
+        ends = np.maximum(0, (self.ends / speed_factor).astype(np.int64))
+        return Timeline(self.sentences, self.texts, starts, ends)
+
+    def window(self, start_ms, duration_ms=None):
+        """Words starting inside the window, rebased on start_ms; sentences left empty are dropped."""
+        keep = self.starts >= start_ms
+        if duration_ms is not None:
+            keep &= self.starts < start_ms + duration_ms
+        sentence_ids = np.repeat(np.arange(len(self.sentences)), [sentence.count for sentence in self.sentences])
+        counts = np.bincount(sentence_ids[keep], minlength=len(self.sentences))
+        kept = np.flatnonzero(keep)
+        return Timeline.from_counts(
+            [sentence.text for sentence, count in zip(self.sentences, counts) if count],
+            counts[counts > 0],
+            [self.texts[i] for i in kept],
+            self.starts[kept] - start_ms,
+            self.ends[kept] - start_ms,
+        )
+
+    def with_texts(self, texts):
+        return Timeline(self.sentences, list(texts), self.starts, self.ends)
+
+    def to_bytes(self):
+        counts = np.array([sentence.count for sentence in self.sentences], dtype=np.int32)
+        text = SEPARATOR.join([sentence.text for sentence in self.sentences] + self.texts).encode("utf-8")
+        return (HEADER.pack(MAGIC, len(self.sentences), len(self.texts)) + self.starts.astype("<i8").tobytes()
+                + self.ends.astype("<i8").tobytes() + counts.astype("<i4").tobytes() + text)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, n_sentences, n_words = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a timeline file")
+        offset = HEADER.size
+        starts = np.frombuffer(data, dtype="<i8", count=n_words, offset=offset)
+        offset += 8 * n_words
+        ends = np.frombuffer(data, dtype="<i8", count=n_words, offset=offset)
+        offset += 8 * n_words
+        counts = np.frombuffer(data, dtype="<i4", count=n_sentences, offset=offset)
+        offset += 4 * n_sentences
+        strings = data[offset:].decode("utf-8").split(SEPARATOR) if n_sentences + n_words else []
+        return cls.from_counts(strings[:n_sentences], counts.tolist(), strings[n_sentences:], starts.copy(), ends.copy())
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
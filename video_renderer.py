@@ -0,0 +1,315 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ffmpeg
+import numpy as np
+from encoder_profiles import ENCODER_PROFILES
+from profiling import PROFILER
+from stage_scheduler import process_context
+
+# Streaming renderer: decode the background once, composite the active lyric
+# overlay onto each frame and pipe raw frames straight into libx264.
+OUTPUT_SIZE = (1080, 1920)
+MIN_SEGMENT_SECONDS = 2.0
+
+
+def probe_video(path):
+    info = ffmpeg.probe(path)
+    stream = next(s for s in info['streams'] if s['codec_type'] == 'video')
+    num, den = stream['r_frame_rate'].split('/')
+    duration = stream.get('duration') or info['format']['duration']
+    return {
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'fps': float(num) / float(den),
+        'duration': float(duration),
+    }
+
+
+def background_filters(stream, size, info, speed_factor=1.0, fps=None):
+    width, height = size
+    if (info['width'], info['height']) != (width, height):
+        stream = stream.filter('scale', width, height)
+    if speed_factor != 1.0:
+        # Speed the background up here, where it is decoded anyway
+        stream = stream.filter('setpts', f'PTS/{speed_factor}')
+    if speed_factor != 1.0 or (fps and fps != info['fps']):
+        # Keep the source frame rate unless another one is asked for
+        stream = stream.filter('fps', fps=fps or info['fps'])
+    return stream
+
+
+def open_background_decoder(video_file, size, info, speed_factor=1.0, start=0.0, fps=None):
+    # `start` is in seconds of the source, before the speed up
+    stream = (ffmpeg.input(video_file, ss=start) if start else ffmpeg.input(video_file)).video
+    stream = background_filters(stream, size, info, speed_factor, fps)
+    return (
+        stream.output('pipe:', format='rawvideo', pix_fmt='rgb24')
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+
+
+def encoder_args(profile):
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {profile}")
+    return {'vcodec': 'libx264', 'pix_fmt': 'yuv420p', **ENCODER_PROFILES[profile]}
+
+
+def open_encoder(output_file, audio_file, size, fps, duration=None, profile="default"):
+    width, height = size
+    frames = ffmpeg.input('pipe:', format='rawvideo', pix_fmt='rgb24', s=f'{width}x{height}', framerate=fps)
+    streams = [frames.video]
+    kwargs = encoder_args(profile)
+    if audio_file:
+        streams.append(ffmpeg.input(audio_file).audio)
+        kwargs['acodec'] = 'aac'
+    if duration:
+        kwargs['t'] = duration
+    return (
+        ffmpeg.output(*streams, output_file, **kwargs)
+        .overwrite_output()
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdin=True)
+    )
+
+
+def read_frame(stream, buffer):
+    view = memoryview(buffer)
+    filled = 0
+    while filled < len(buffer):
+        n = stream.readinto(view[filled:])
+        if not n:
+            return False
+        filled += n
+    return True
+
+
+def prepare_overlay(overlay):
+    # Premultiply once per overlay so the per-frame blend is two multiplies and an add
+    pixels, (x, y) = overlay
+    alpha = pixels[..., 3:4].astype(np.uint16)
+    return pixels[..., :3].astype(np.uint16) * alpha, 255 - alpha, (x, y)
+
+
+def composite(frame, prepared):
+    premultiplied, inverse_alpha, (x, y) = prepared
+    height, width = premultiplied.shape[:2]
+    frame_height, frame_width = frame.shape[:2]
+
+    # Clip the overlay box to the frame
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + width, frame_width), min(y + height, frame_height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+    region = frame[y0:y1, x0:x1]
+    blended = premultiplied[src] + region * inverse_alpha[src]
+    region[:] = (blended + 127) // 255
+
+
+def stream_frames(decoder, encoder, events, make_overlay, fps, size, first_frame=0, frame_count=None):
+    """Composite the lyric timeline onto decoded frames and feed them to the encoder.
+
+    `events` is a list of (start_s, end_s, payload) sorted by start; frame times
+    start at `first_frame`. Only the overlay of the event currently on screen is
+    kept in memory. Returns (frames, overlays) written.
+    """
+    width, height = size
+    buffer = bytearray(width * height * 3)
+    frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+
+    overlays = 0
+    next_event = 0
+    live = []  # events that have started and not yet ended
+    active = None
+    prepared = None
+    frames = 0
+    while (frame_count is None or frames < frame_count) and read_frame(decoder.stdout, buffer):
+        t = (first_frame + frames) / fps
+        while next_event < len(events) and events[next_event][0] <= t:
+            live.append(events[next_event])
+            next_event += 1
+        live = [event for event in live if event[1] > t]
+
+        # The most recently started event wins when two overlap
+        current = live[-1] if live else None
+        if current is not active:
+            active = current
+            prepared = prepare_overlay(make_overlay(current[2])) if current else None
+            overlays += bool(current)
+        if prepared:
+            composite(frame, prepared)
+
+        encoder.stdin.write(buffer)
+        frames += 1
+    return frames, overlays
+
+
+def close_pipes(decoder, encoder):
+    try:
+        encoder.stdin.close()
+        decoder.stdout.close()
+    finally:
+        encoder.wait()
+        decoder.wait()
+    if encoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg encoder exited with code {encoder.returncode}")
+
+
+def output_duration(info, speed_factor, duration=None):
+    # The sped-up background, cut to `duration` when one background serves several speeds
+    played = info['duration'] / speed_factor
+    return min(played, duration) if duration else played
+
+
+def set_render_counters(frames, overlays, fps, elapsed):
+    PROFILER.set_counters(
+        frames_rendered=frames,
+        overlays_created=overlays,
+        frames_per_second=round(frames / elapsed, 2),
+        encoder_speed=round(frames / fps / elapsed, 3),  # seconds of video per second of wall time
+    )
+
+
+def render_lyrics_frames(video_file, audio_file, output_file, events, make_overlay, size=OUTPUT_SIZE, profile="default", speed_factor=1.0,
+                         fps=None, duration=None):
+    """Walk the lyric timeline once and stream composited frames to the encoder.
+
+    `events` is a list of (start_s, end_s, payload); `make_overlay(payload)` returns
+    an RGBA array and its (x, y) position. The background is played
+    `speed_factor` times faster, at `fps` if given (the source rate otherwise),
+    for at most `duration` seconds. Returns the number of frames rendered.
+    """
+    info = probe_video(video_file)
+    fps = fps or info['fps']
+    duration = output_duration(info, speed_factor, duration)
+    events = sorted(events, key=lambda event: event[0])
+
+    encoder_args(profile)  # an unknown profile fails before the decoder starts
+    started = time.perf_counter()
+    decoder = open_background_decoder(video_file, size, info, speed_factor, fps=fps)
+    encoder = open_encoder(output_file, audio_file, size, fps, duration, profile)
+    try:
+        frames, overlays = stream_frames(decoder, encoder, events, make_overlay, fps, size, frame_count=int(round(duration * fps)))
+    finally:
+        close_pipes(decoder, encoder)
+
+    set_render_counters(frames, overlays, fps, time.perf_counter() - started)
+    return frames
+
+
+def render_segment(video_file, output_file, events, make_overlay, first_frame, frame_count, size=OUTPUT_SIZE,
+                   profile="segment", speed_factor=1.0):
+    # Worker process entry point: one video-only segment of the output timeline
+    info = probe_video(video_file)
+    fps = info['fps']
+    encoder_args(profile)
+    decoder = open_background_decoder(video_file, size, info, speed_factor, start=first_frame / fps * speed_factor)
+    encoder = open_encoder(output_file, None, size, fps, profile=profile)
+    try:
+        return stream_frames(decoder, encoder, events, make_overlay, fps, size, first_frame, frame_count)
+    finally:
+        close_pipes(decoder, encoder)
+
+
+def concat_segments(segment_files, audio_file, output_file, duration):
+    # Every segment opens with its own keyframe and shares the encoder settings,
+    # so the concat demuxer joins them without re-encoding; only the audio is encoded
+    list_file = os.path.join(os.path.dirname(segment_files[0]), "segments.txt")
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for segment_file in segment_files:
+            f.write(f"file '{os.path.abspath(segment_file)}'\n")
+    streams = [ffmpeg.input(list_file, format='concat', safe=0).video]
+    kwargs = {'vcodec': 'copy', 't': duration}
+    if audio_file:
+        streams.append(ffmpeg.input(audio_file).audio)
+        kwargs['acodec'] = 'aac'
+    (
+        ffmpeg.output(*streams, output_file, **kwargs)
+        .overwrite_output()
+        .global_args('-loglevel', 'error')
+        .run()
+    )
+
+
+def render_lyrics_segments(video_file, audio_file, output_file, events, make_overlay, size=OUTPUT_SIZE,
+                           profile="segment", speed_factor=1.0, workers=2, duration=None):
+    """Render and encode the timeline as segments in parallel worker processes.
+
+    Same arguments as render_lyrics_frames; `make_overlay` and the event payloads
+    must be picklable. `workers` encoders run at once, the caller sizes it.
+    Segments are at least MIN_SEGMENT_SECONDS long and are joined with a
+    stream copy. Returns the number of frames rendered.
+    """
+    encoder_args(profile)
+    info = probe_video(video_file)
+    fps = info['fps']
+    duration = output_duration(info, speed_factor, duration)
+    total_frames = int(duration * fps)
+    segment_frames = max(int(MIN_SEGMENT_SECONDS * fps), -(-total_frames // workers))
+    events = sorted(events, key=lambda event: event[0])
+
+    started = time.perf_counter()
+    segment_dir = tempfile.mkdtemp(prefix=".segments_", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        futures, segment_files = [], []
+        # Started from a forkserver, the caller's stage threads may be running
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as pool:
+            for number, first_frame in enumerate(range(0, total_frames, segment_frames)):
+                frame_count = min(segment_frames, total_frames - first_frame)
+                start_s, end_s = first_frame / fps, (first_frame + frame_count) / fps
+                # Each worker only receives the events visible in its segment
+                segment_events = [event for event in events if event[1] > start_s and event[0] < end_s]
+                segment_file = os.path.join(segment_dir, f"segment_{number:04d}.mp4")
+                segment_files.append(segment_file)
+                futures.append(pool.submit(
+                    render_segment, video_file, segment_file, segment_events, make_overlay,
+                    first_frame, frame_count, size, profile, speed_factor,
+                ))
+            counts = [future.result() for future in futures]
+        concat_segments(segment_files, audio_file, output_file, duration)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+    frames = sum(frames for frames, _ in counts)
+    set_render_counters(frames, sum(overlays for _, overlays in counts), fps, time.perf_counter() - started)
+    PROFILER.set_counters(segments=len(counts))
+    return frames
+
+
+def render_ass_video(video_file, audio_file, output_file, ass_file, fonts_dir=None, size=OUTPUT_SIZE, profile="default", speed_factor=1.0,
+                     fps=None, duration=None):
+    """Burn an ASS karaoke script into the background in the encoding pass itself.
+
+    Scaling, speed up and libass rendering all run inside one ffmpeg filter graph,
+    so no frame goes through Python. Returns the output duration in seconds.
+    """
+    info = probe_video(video_file)
+    duration = output_duration(info, speed_factor, duration)
+
+    # libass scales the script's 1080x1920 PlayRes to whatever `size` is
+    stream = background_filters(ffmpeg.input(video_file).video, size, info, speed_factor, fps)
+    ass_args = {'fontsdir': fonts_dir} if fonts_dir else {}
+    stream = stream.filter('ass', ass_file, **ass_args)
+    streams = [stream]
+    kwargs = encoder_args(profile)
+    if audio_file:
+        streams.append(ffmpeg.input(audio_file).audio)
+        kwargs['acodec'] = 'aac'
+
+    started = time.perf_counter()
+    (
+        ffmpeg.output(*streams, output_file, t=duration, **kwargs)
+        .overwrite_output()
+        .global_args('-loglevel', 'error')
+        .run()
+    )
+    elapsed = time.perf_counter() - started
+    PROFILER.set_counters(
+        frames_rendered=int(duration * (fps or info['fps'])),
+        encoder_speed=round(duration / elapsed, 3),
+    )
+    return duration
@@ -0,0 +1,57 @@
+# Windowed alignment: only the audio that ends up in the clip (plus a margin)
+# is aligned, against the slice of the lyrics a coarse pass places in it.
+# The aligner places every word it is given, so the lyric slice never reaches
+# past the audio window. The coarse pass only spreads lines by word count and
+# misses intros, breaks and repeated choruses, which is why run_pipeline keeps
+# the full-song alignment as its default, and a window result is checked before
+# it is used or cached.
+AUDIO_MARGIN_MS = 5000
+MIN_MATCHED_RATIO = 0.8
+# Lyrics not sung in the window get squeezed into whatever audio is left
+MIN_MEDIAN_WORD_MS = 80
+
+
+def estimate_line_times(lines, song_duration_ms):
+    """Coarse line timing: spread the lines over the song in proportion to their word counts."""
+    counts = [max(len(line.split()), 1) if line.strip() else 0 for line in lines]
+    total = sum(counts) or 1
+    times = []
+    elapsed = 0
+    for count in counts:
+        start_ms = song_duration_ms * elapsed / total
+        elapsed += count
+        times.append((start_ms, song_duration_ms * elapsed / total))
+    return times
+
+
+def select_lyric_window(lyrics_text, line_times, start_ms, end_ms):
+    """Keep the lines whose estimated time lies inside [start_ms, end_ms]."""
+    lines = lyrics_text.split('\n')
+    selected = []
+    for line, times in zip(lines, line_times):
+        if not line.strip():
+            continue
+        line_start, line_end = times
+        if line_start >= start_ms and line_end <= end_ms:
+            selected.append(line)
+    return '\n'.join(selected)
+
+
+def shift_aligned_text(aligned_text, offset_ms):
+    # Move "start end WORD" lines from window time back to song time
+    shifted = []
+    offset_s = offset_ms / 1000
+    for line in aligned_text.split('\n'):
+        parts = line.split()
+        if len(parts) == 3:
+            start_time, end_time, word = parts
+            shifted.append(f"{float(start_time) + offset_s:.2f} {float(end_time) + offset_s:.2f} {word}")
+    return '\n'.join(shifted) + '\n'
+
+
+def window_alignment_plausible(stats, entries, min_matched=MIN_MATCHED_RATIO, min_word_ms=MIN_MEDIAN_WORD_MS):
+    """False when the aligned words do not match the lyric slice or were squeezed into too little audio."""
+    if not entries or stats["matched"] < min_matched * max(stats["lyric_words"], 1):
+        return False
+    durations = sorted(int(entry["endTimeMs"]) - int(entry["startTimeMs"]) for entry in entries)
+    return durations[len(durations) // 2] >= min_word_ms